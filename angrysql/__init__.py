@@ -14,9 +14,9 @@
 
 __all__ = ['Integer', 'TinyInteger', 'SmallInteger',
            'BigInt', 'String', 'Year', 'Date', 'Time',
-           'DataTime', 'TimeStamp', 'BaseModel', 'Column',
-           'or_', 'and_',
-           'Connection']
+           'DataTime', 'TimeStamp', 'BaseModel', 'Column', 'Index',
+           'or_', 'and_', 'count', 'UNSET',
+           'Connection', 'AsyncConnection']
 
 from .schema import (
     Integer,
@@ -30,8 +30,12 @@ from .schema import (
     DataTime,
     TimeStamp,
     Column,
+    Index,
     or_,
-    and_)
+    and_,
+    count,
+    UNSET)
 from .base import BaseModel
 from .connections import Connection
+from .aio import AsyncConnection
 # from .sqlitedb import SqliteConnection
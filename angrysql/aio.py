@@ -0,0 +1,199 @@
+# Copyright 2019 AngrySoft Sebastian Zwierzchowski
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from inspect import ismethod
+from itertools import islice
+from .connections import Connection
+
+# query methods which only build the statement, the others use the connection
+BUILDERS = frozenset(['where', 'order_by', 'columns', 'limit', 'offset', 'page_after', 'cache',
+                      'prefetch', 'select_related', 'group_by', 'having', 'on_conflict',
+                      'inner', 'left', 'right', 'full', 'compile'])
+
+
+class AsyncConnection:
+    """
+    Asyncio front end for a Connection. The connection lives on its own worker
+    thread, so queries never block the event loop. Open one AsyncConnection
+    per concurrent stream of queries.
+
+        async with AsyncConnection('sqlite://app.db') as db:
+            users = await db.select(Users).where(Users.login == 'admin').all()
+            async for u in db.select(Users):
+                print(u.login)
+    """
+
+    def __init__(self, url, echo=False, **options):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='angrysql')
+        # sqlite connections must be used from the thread which opened them
+        self.db = self._executor.submit(partial(Connection, url, echo=echo, **options)).result()
+
+    async def run(self, func, *args, **kwargs):
+        """Call func on the connection thread and await its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def select(self, model):
+        return AsyncQuery(self, self.db.select(model))
+
+    def insert(self, model):
+        return AsyncQuery(self, self.db.insert(model))
+
+    def update(self, model):
+        return AsyncQuery(self, self.db.update(model))
+
+    def delete(self, model):
+        return AsyncQuery(self, self.db.delete(model))
+
+    def join(self, *models):
+        return AsyncQuery(self, self.db.join(*models))
+
+    async def execute(self, sql, args=()):
+        return await self.run(self.db.execute, sql, args)
+
+    async def create_tables(self, *models):
+        return await self.run(self.db.create_tables, *models)
+
+    async def insert_many(self, models, chunk_size=1000):
+        return await self.run(self.db.insert_many, models, chunk_size=chunk_size)
+
+    async def upsert_many(self, models, conflict, update=None, chunk_size=1000):
+        return await self.run(self.db.upsert_many, models, conflict, update=update, chunk_size=chunk_size)
+
+    async def commit(self):
+        return await self.run(self.db.commit)
+
+    async def rollback(self):
+        return await self.run(self.db.rollback)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Async form of BaseDatabase.transaction, nested blocks are savepoints"""
+        block = self.db.transaction()
+        await self.run(block.__enter__)
+        try:
+            yield self
+        except BaseException as err:
+            await self.run(block.__exit__, type(err), err, err.__traceback__)
+            raise
+        await self.run(block.__exit__, None, None, None)
+
+    async def close(self):
+        await self.run(self.db.close)
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class AsyncQuery:
+    """
+    Wraps a query builder of AsyncConnection.db. Building methods (where,
+    order_by, columns, ...) work as usual, terminal methods are awaitable.
+    Other methods of the query are not available, they would run on the
+    event loop thread.
+    """
+
+    def __init__(self, conn, query):
+        self._conn = conn
+        self._query = query
+
+    def __getattr__(self, name):
+        attr = getattr(self._query, name)
+        if not ismethod(attr):
+            return attr
+        if name not in BUILDERS:
+            raise AttributeError(f'{name} is not available on AsyncQuery, '
+                                 f'call it with AsyncConnection.run on the connection thread')
+
+        def builder(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if result is self._query:
+                return self
+            return result
+
+        return builder
+
+    async def all(self):
+        return await self._conn.run(self._query.all)
+
+    async def one(self):
+        return await self._conn.run(self._query.one)
+
+    async def get(self, model_id):
+        return await self._conn.run(self._query.get, model_id)
+
+    async def many(self, size):
+        return await self._conn.run(self._query.many, size)
+
+    async def do(self):
+        return await self._conn.run(self._query.do)
+
+    async def tuples(self):
+        return await self._conn.run(self._query.tuples)
+
+    async def dicts(self):
+        return await self._conn.run(self._query.dicts)
+
+    async def scalars(self):
+        return await self._conn.run(self._query.scalars)
+
+    async def first_scalar(self):
+        return await self._conn.run(self._query.first_scalar)
+
+    async def page(self):
+        return await self._conn.run(self._query.page)
+
+    async def count(self):
+        return await self._conn.run(self._query.count)
+
+    async def exists(self):
+        return await self._conn.run(self._query.exists)
+
+    async def sum(self, column):
+        return await self._conn.run(self._query.sum, column)
+
+    async def avg(self, column):
+        return await self._conn.run(self._query.avg, column)
+
+    async def min(self, column):
+        return await self._conn.run(self._query.min, column)
+
+    async def max(self, column):
+        return await self._conn.run(self._query.max, column)
+
+    async def aggregate(self, *expressions):
+        return await self._conn.run(self._query.aggregate, *expressions)
+
+    async def iter(self, batch_size=1000):
+        """Async generator over the results, fetched batch_size rows at a time"""
+        rows = await self._conn.run(self._query.iter, batch_size)
+        try:
+            while True:
+                batch = await self._conn.run(list, islice(rows, batch_size))
+                if not batch:
+                    break
+                for item in batch:
+                    yield item
+        finally:
+            await self._conn.run(rows.close)
+
+    def __aiter__(self):
+        return self.iter()
@@ -11,26 +11,161 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from .schema import Column, Integer, String
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from copy import copy
+from datetime import date, datetime, time
+from decimal import Decimal
+from operator import itemgetter
+from time import monotonic, perf_counter
+import json
+import logging
+import sys
+from .cache import LRUCache, IdentityMap
+from .schema import (Column, Index, Integer, UNSET, BinaryExpression, as_expression, and_, or_,
+                     inline_sql, count, Expression, Label, Text, _operand, _operand_shape, _operand_collect)
+
+log = logging.getLogger('angrysql')
+slow_log = logging.getLogger('angrysql.slow')
+
+SlowQuery = namedtuple('SlowQuery', 'sql args duration plan')
+
+# models by table name, foreign keys are resolved through it
+model_registry = dict()
+
+HOOKS = ('before_execute', 'after_execute', 'on_error', 'after_fetch', 'on_hydrate', 'on_commit')
+
+
+def _echo_to_stdout():
+    # echo=True keeps printing statements when the application has not configured logging,
+    # configured logging gets the records through propagation as set up there
+    if log.handlers or logging.getLogger().handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(handler)
+    if log.getEffectiveLevel() > logging.INFO:
+        log.setLevel(logging.INFO)
+
 
 class BaseDatabase:
     __tabletemplate__ = 'CREATE TABLE IF NOT EXISTS {} ({})'
     _conn = None
     _cur = None
+    placeholder = '?'
+    identity_map = None
+    result_cache = None
+    metrics = None
+    max_placeholders = 999
+    driver_errors = ()
+    explain_prefix = 'EXPLAIN'
+    # other statements can run while iterate streams a result
+    query_while_streaming = True
+    slow_query_threshold = None
+    explain_slow_queries = False
+    last_duration = 0.0
 
     def __init__(self, echo=False):
-        Select.__db__ = self
-        Insert.__db__ = self
-        Update.__db__ = self
-        Delete.__db__ = self
-        Join.__db__ = self
-        self.select = Select
-        self.insert = Insert
-        self.update = Update
-        self.delete = Delete
-        self.join = Join
+        # query builders bound to this connection only
+        self.select = self._bind(Select)
+        self.insert = self._bind(Insert)
+        self.update = self._bind(Update)
+        self.delete = self._bind(Delete)
+        self.join = self._bind(Join)
 
         self.echo = echo
+        if echo:
+            _echo_to_stdout()
+        self.slow_queries = deque(maxlen=100)
+        self.hooks = {name: list() for name in HOOKS}
+        self._tx_depth = 0
+        self._tx_error = None
+        self._written = set()
+        self._group_commit = None
+        self._pending_commits = 0
+        self._pending_since = 0.0
+
+    def _bind(self, query_class):
+        return type(query_class.__name__, (query_class,), {'__db__': self})
+
+    def use_identity_map(self, maxsize=1024):
+        """
+        Keep up to maxsize models loaded by Select.get and return them again
+        for the same primary key. Update and Delete drop the cached models of
+        the table they touch, rollback drops all of them.
+        """
+        self.identity_map = IdentityMap(maxsize)
+        return self.identity_map
+
+    def use_result_cache(self, backend):
+        """
+        Store results of queries marked with Select.cache() in backend, for
+        example MemoryResultCache or SqliteResultCache. Insert, Update and
+        Delete drop cached results of the tables they write to, commit and
+        rollback drop them again, results cached while the transaction was
+        open may hold rows which other connections never see.
+        """
+        self.result_cache = backend
+        return backend
+
+    def on(self, event, func):
+        """
+        Call func on event, func gets the connection as the first argument:
+            before_execute(db, sql, args)
+            after_execute(db, sql, args, duration, rowcount)
+            on_error(db, sql, args, duration, error)
+            after_fetch(db, count)
+            on_hydrate(db, model, instances)
+            on_commit(db)
+        """
+        if event not in self.hooks:
+            raise ValueError(f'unknown event {event}')
+        self.hooks[event].append(func)
+        return func
+
+    def off(self, event, func):
+        self.hooks[event].remove(func)
+
+    def _emit(self, event, *args):
+        for func in self.hooks[event]:
+            func(self, *args)
+
+    def session(self):
+        """New Session, a unit of work writing the changes of the models added to it"""
+        from .session import Session
+        return Session(self)
+
+    def use_metrics(self, metrics=None):
+        """
+        Collect statement metrics in metrics, a new Metrics registry when
+        not given. Pass the same registry to several connections to
+        aggregate them.
+        """
+        if metrics is None:
+            from .metrics import Metrics
+            metrics = Metrics()
+        if self.metrics is not metrics:
+            if self.metrics is not None:
+                self.metrics.detach(self)
+            metrics.attach(self)
+            self.metrics = metrics
+        return metrics
+
+    def _invalidate(self, table_name):
+        if self.identity_map is not None:
+            self.identity_map.invalidate(table_name)
+        if self.result_cache is not None:
+            self.result_cache.invalidate(table_name)
+            self._written.add(table_name)
+
+    def _invalidate_written(self, keep=False):
+        """Drop cached results of the tables written since the last commit or rollback"""
+        if self.result_cache is not None:
+            for table_name in self._written:
+                self.result_cache.invalidate(table_name)
+        if not keep:
+            self._written.clear()
 
     def create_tables(self, *models):
         for model in models:
@@ -44,7 +179,10 @@ class BaseDatabase:
                     columns.append(self.foreignkey_column_sql(fkey))
 
             self.execute(self.table_schema(model.table_name, columns))
-        self.commit()
+            for index in model.indexes():
+                self.create_index(model, index)
+        if not self._tx_depth:
+            self.commit()
 
     def column_to_sql(self, column):
         opts = list()
@@ -66,6 +204,31 @@ class BaseDatabase:
         return ' '.join(opts)
     
     
+    def create_index(self, model, index):
+        return self.execute(self.index_sql(model.table_name, index))
+
+    def index_sql(self, table_name, index, if_not_exists=True):
+        columns = ','.join([self.index_column(index, c) for c in index.all_columns()])
+        sql = 'CREATE UNIQUE INDEX' if index.unique else 'CREATE INDEX'
+        if if_not_exists:
+            sql += ' IF NOT EXISTS'
+        sql += f' {index.index_name(table_name)} ON {table_name} ({columns})'
+        if index.where is not None:
+            sql += f' WHERE {inline_sql(index.where)}'
+        return sql
+
+    @staticmethod
+    def index_column(index, column):
+        return column.column_name
+
+    @staticmethod
+    def upsert_clause(conflict, update):
+        """Conflict clause of an upsert, conflict and update are column names"""
+        if not update:
+            return f" ON CONFLICT ({','.join(conflict)}) DO NOTHING"
+        values = ','.join([f'{name} = excluded.{name}' for name in update])
+        return f" ON CONFLICT ({','.join(conflict)}) DO UPDATE SET {values}"
+
     def foreignkey_column_sql(self, column):
         if column.foreignkey.find('.') < 0:
             raise ValueError('Proper value is tablename.columnname')
@@ -77,8 +240,179 @@ class BaseDatabase:
                                column_full_name=column.column_full_name)
 
     def execute(self, sql, args=()):
-        print(f'{sql} args = {args}')
-        return ''
+        return self._run(self._cur.execute, sql, args)
+
+    def executemany(self, sql, seq_of_args):
+        return self._run(self._cur.executemany, sql, seq_of_args, many=True)
+
+    def _run(self, method, sql, args, many=False):
+        """
+        Run and time one statement. Driver errors are logged to the angrysql
+        logger and returned, other exceptions propagate.
+        """
+        hooks = self.hooks
+        if hooks['before_execute']:
+            self._emit('before_execute', sql, args)
+        error = None
+        start = perf_counter()
+        try:
+            method(sql, args)
+        except self.driver_errors as err:
+            error = err
+        duration = perf_counter() - start
+        self.last_duration = duration
+        if self.echo:
+            log.info('%s args = %s [%.3f ms]', sql, args, duration * 1000)
+        if error is not None:
+            log.error('%s: %s', type(error).__name__, error,
+                      extra={'sql': sql, 'params': args, 'duration': duration})
+            if self._tx_depth and self._tx_error is None:
+                # the open transaction block rolls back when it ends
+                self._tx_error = error
+            if hooks['on_error']:
+                self._emit('on_error', sql, args, duration, error)
+            return error
+        if hooks['after_execute']:
+            self._emit('after_execute', sql, args, duration, getattr(method.__self__, 'rowcount', -1))
+        if self.slow_query_threshold is not None and duration >= self.slow_query_threshold:
+            if many:
+                args = args[0] if isinstance(args, (list, tuple)) and args else ()
+            self._slow_query(sql, args, duration)
+        return None
+
+    def log_slow_queries(self, threshold=0.1, explain=False, keep=100):
+        """
+        Record statements running longer than threshold seconds in
+        slow_queries and log them to the angrysql.slow logger.
+        :param threshold: seconds, None turns the slow query log off
+        :param explain: attach the query plan of slow statements
+        :param keep: number of slow statements kept in slow_queries
+        """
+        self.slow_query_threshold = threshold
+        self.explain_slow_queries = explain
+        self.slow_queries = deque(self.slow_queries, maxlen=keep)
+        return self.slow_queries
+
+    def _slow_query(self, sql, args, duration):
+        plan = None
+        if self.explain_slow_queries and sql.lstrip()[:6].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'):
+            plan = self.explain(sql, args)
+        self.slow_queries.append(SlowQuery(sql, args, duration, plan))
+        slow_log.warning('slow query [%.3f ms]: %s', duration * 1000, sql,
+                         extra={'sql': sql, 'params': args, 'duration': duration, 'plan': plan})
+
+    def explain(self, sql, args=()):
+        """
+        Return the plan rows the database reports for sql, or None when sql
+        can not be explained. Runs on its own cursor.
+        """
+        cur = self._conn.cursor()
+        try:
+            if args:
+                cur.execute(f'{self.explain_prefix} {sql}', args)
+            else:
+                cur.execute(f'{self.explain_prefix} {sql}')
+            return cur.fetchall()
+        except self.driver_errors as err:
+            log.debug('can not explain %s: %s', sql, err)
+            return None
+        finally:
+            cur.close()
+
+    def insert_many(self, models, chunk_size=1000):
+        """
+        Insert model instances in batches instead of one statement per row.
+        Models are grouped by the set of columns they have values for, the ones
+        without a primary key value get the generated key on sqlite and MySQL.
+        :param models: iterable of model instances
+        :param chunk_size: maximum number of rows sent in one batch
+        :return: number of inserted rows
+        """
+        return self._insert_queries(map(self.insert, models), chunk_size)
+
+    def prefetch(self, instances, *columns):
+        """
+        Load the rows related to instances through foreign key columns, one
+        IN query per max_placeholders keys, and attach them to the instances,
+        see BaseModel.related. A column of the instances' model attaches the
+        row it points to, a column of another model pointing at the instances'
+        model attaches the list of rows referring to each instance.
+        """
+        instances = list(instances)
+        if not instances:
+            return instances
+        parent = type(instances[0])
+        for column in columns:
+            target = related_column(column)
+            if column.model is parent:
+                by_key = dict()
+                keys = [getattr(i, column.column_name) for i in instances]
+                for row in self._fetch_in(target.model, target, keys):
+                    by_key[getattr(row, target.column_name)] = row
+                for i in instances:
+                    i._attach(column, by_key.get(getattr(i, column.column_name)))
+            elif target.model is parent:
+                groups = dict()
+                keys = [getattr(i, target.column_name) for i in instances]
+                for row in self._fetch_in(column.model, column, keys):
+                    groups.setdefault(getattr(row, column.column_name), list()).append(row)
+                for i in instances:
+                    i._attach(column, groups.get(getattr(i, target.column_name), list()))
+            else:
+                raise ValueError(f'{column.column_full_name} does not refer to or from {parent.__name__}')
+        return instances
+
+    def _fetch_in(self, model, column, keys):
+        keys = list(dict.fromkeys([k for k in keys if k is not None]))
+        rows = list()
+        for start in range(0, len(keys), self.max_placeholders):
+            rows.extend(self.select(model).where(column.in_(*keys[start:start + self.max_placeholders])).all())
+        return rows
+
+    def upsert_many(self, models, conflict, update=None, chunk_size=1000):
+        """
+        Insert model instances in batches, rows clashing with an existing row
+        on the conflict columns update that row instead.
+        :param models: iterable of model instances
+        :param conflict: columns of the unique key the rows may clash on
+        :param update: columns to overwrite on a clash, by default all inserted
+                       columns except the conflict and primary key columns
+        :param chunk_size: maximum number of rows sent in one batch
+        :return: number of rows the database reports as changed
+        """
+        return self._insert_queries((self.insert(m).on_conflict(conflict, update) for m in models), chunk_size)
+
+    def _insert_queries(self, queries, chunk_size, written=None):
+        """
+        Insert queries grouped by shape. When written is a list, models of the
+        batches which went in without a driver error are appended to it.
+        """
+        groups = dict()
+        for query in queries:
+            key = (type(query.model), query._base_shape())
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = (query, list(), list())
+            group[1].append(tuple(query._args))
+            group[2].append(query.model)
+
+        count = 0
+        for query, rows, instances in groups.values():
+            for start in range(0, len(rows), chunk_size):
+                count += self._insert_rows(query,
+                                           rows[start:start + chunk_size],
+                                           instances[start:start + chunk_size])
+                if written is not None and not query.errors:
+                    written.extend(instances[start:start + chunk_size])
+            self._invalidate(query.model.table_name)
+        return count
+
+    def _insert_rows(self, query, rows, models):
+        sql, args = query.compile()
+        query.errors = self.executemany(sql, rows)
+        if query.errors:
+            return 0
+        return self.rowcount
 
     # def fetch(self, one=None):
     #     rows = list()
@@ -96,43 +430,248 @@ class BaseDatabase:
     #         ret.append(fields)
     #     return ret
 
-    def fetch(self, model):
-        ret = list()
-        for row in self._cur.fetchall():
-            ret.append(self._model(row, model))
-        return ret
+    def fetch(self, model, cur=None):
+        if cur is None:
+            cur = self._cur
+        rows = cur.fetchall()
+        self._emit('after_fetch', len(rows))
+        if not rows:
+            return list()
+        models = list(map(self._hydrator(model, cur.description), rows))
+        self._emit('on_hydrate', model, models)
+        return models
     
-    def fetchone(self, model):
-        row = self._cur.fetchone()
+    def fetchone(self, model, cur=None):
+        if cur is None:
+            cur = self._cur
+        row = cur.fetchone()
         if row:
-            return self._model(row, model)
+            self._emit('after_fetch', 1)
+            return self._model(row, model, cur.description)
     
-    def fetchmany(self, model, size=1):
-        row = self._cur.fetchmany(size=self._cur.arraysize=size)
+    def fetchmany(self, model, size=1, cur=None):
+        if cur is None:
+            cur = self._cur
+        rows = cur.fetchmany(size)
+        self._emit('after_fetch', len(rows))
+        if not rows:
+            return list()
+        models = list(map(self._hydrator(model, cur.description), rows))
+        self._emit('on_hydrate', model, models)
+        return models
+
+    def fetch_tuples(self, cur=None):
+        if cur is None:
+            cur = self._cur
+        rows = cur.fetchall()
+        self._emit('after_fetch', len(rows))
+        return list(rows)
+
+    def fetch_dicts(self, cur=None):
+        if cur is None:
+            cur = self._cur
+        rows = cur.fetchall()
+        self._emit('after_fetch', len(rows))
+        if not rows:
+            return list()
+        names = [d[0] for d in cur.description]
+        return [dict(zip(names, row)) for row in rows]
+
+    def fetch_scalars(self, cur=None):
+        if cur is None:
+            cur = self._cur
+        rows = cur.fetchall()
+        self._emit('after_fetch', len(rows))
+        return [row[0] for row in rows]
+
+    def fetch_scalar(self, cur=None):
+        if cur is None:
+            cur = self._cur
+        row = cur.fetchone()
         if row:
-            return self._model(row, model)
+            self._emit('after_fetch', 1)
+            return row[0]
+
+    def execute_cached(self, sql, args, tables, ttl=None):
+        """
+        Return a ResultSet for sql and args from result_cache, running the
+        query and storing its rows on a miss. tables are the tables the query
+        reads, writes to any of them drop the entry.
+        """
+        key = (sql, tuple(args))
+        cached = self.result_cache.get(key)
+        if cached is None:
+            errors = self.execute(sql, args)
+            if errors or self._cur.description is None:
+                return ResultSet((), [])
+            cached = (tuple([d[0] for d in self._cur.description]), self._cur.fetchall())
+            self.result_cache.put(key, cached, tables, ttl)
+        return ResultSet(*cached)
+
+    def iterate(self, model, sql, args=(), batch_size=1000, prefetch=()):
+        """
+        Run a query on its own cursor and yield models batch by batch,
+        so only batch_size rows are held in memory at once. The prefetch
+        columns are loaded for every batch, see prefetch.
+        """
+        cur = self._stream_cursor()
+        try:
+            if self._run(cur.execute, sql, args):
+                return
+            cur.arraysize = batch_size
+            rows = cur.fetchmany(batch_size)
+            if rows:
+                hydrate = self._hydrator(model, cur.description)
+            while rows:
+                self._emit('after_fetch', len(rows))
+                models = list(map(hydrate, rows))
+                self._emit('on_hydrate', model, models)
+                if prefetch:
+                    self.prefetch(models, *prefetch)
+                yield from models
+                rows = cur.fetchmany(batch_size)
+        finally:
+            cur.close()
+
+    def _stream_cursor(self):
+        return self._conn.cursor()
     
-    def _model(self, row, model):
-        new_model = model()
-        for idx, col in enumerate(self._cur.description):
-            if hasattr(new_model, col[0]):
-                setattr(new_model, col[0], row[idx])
-                
-        for col in new_model.columns():
-            _col = getattr(new_model, col.column_name)
-            if isinstance(_col, Column):
-                setattr(new_model, col.column_name, None)
-            
-        return new_model
+    def _model(self, row, model, description=None):
+        if description is None:
+            description = self._cur.description
+        instance = self._hydrator(model, description)(row)
+        self._emit('on_hydrate', model, [instance])
+        return instance
+
+    @staticmethod
+    def _hydrator(model, description):
+        """Row to model function, built once per model and result columns"""
+        names = tuple([d[0] for d in description])
+        hydrate = model.__hydrators__.get(names)
+        if hydrate is None:
+            hydrate = model._build_hydrator(names)
+            model.__hydrators__.put(names, hydrate)
+        return hydrate
                     
+    def ping(self):
+        """True when the connection still answers a trivial query"""
+        try:
+            cur = self._conn.cursor()
+            cur.execute('SELECT 1')
+            cur.fetchall()
+            cur.close()
+        except Exception:
+            return False
+        return True
+
+    def begin(self):
+        self.execute('BEGIN')
+
+    @contextmanager
+    def transaction(self):
+        """
+        Commit when the block finishes and roll back when it raises.
+        Nested blocks become savepoints, so an inner failure only undoes
+        the inner block. execute still returns driver errors inside the
+        block, but the block is rolled back when it ends and the first
+        of them is raised.
+        """
+        savepoint = None
+        if self._tx_depth:
+            savepoint = f'sp_{self._tx_depth}'
+            self.execute(f'SAVEPOINT {savepoint}')
+        else:
+            self.begin()
+        outer_error, self._tx_error = self._tx_error, None
+        self._tx_depth += 1
+        try:
+            yield self
+            if self._tx_error is not None:
+                raise self._tx_error
+        except BaseException:
+            self._tx_depth -= 1
+            self._tx_error = outer_error
+            if savepoint:
+                if self.identity_map is not None:
+                    self.identity_map.invalidate_all()
+                self.execute(f'ROLLBACK TO SAVEPOINT {savepoint}')
+                # the outer transaction is still open
+                self._invalidate_written(keep=True)
+                self.execute(f'RELEASE SAVEPOINT {savepoint}')
+            else:
+                self.rollback()
+            raise
+        self._tx_depth -= 1
+        self._tx_error = outer_error
+        if savepoint:
+            self.execute(f'RELEASE SAVEPOINT {savepoint}')
+        else:
+            self.commit()
+
+    @contextmanager
+    def group_commit(self, max_writes=1000, max_delay=1.0):
+        """
+        Batch commits: inside the block commit() only marks the work done so far
+        and the real commit happens when the block ends, or in the commit() call
+        which reaches max_writes pending commits or finds that max_delay seconds
+        passed since the first pending one. The delay is only checked by
+        commit(), a writer which goes idle should call flush_commits().
+        rollback() still only undoes work which was not committed.
+        """
+        previous = self._group_commit
+        self._group_commit = (max_writes, max_delay)
+        try:
+            yield self
+        finally:
+            self._group_commit = previous
+            self.flush_commits()
+
     def commit(self):
+        if self._group_commit is None:
+            self._commit()
+            return
+        if not self._pending_commits:
+            self._pending_since = monotonic()
+        self._pending_commits += 1
+        max_writes, max_delay = self._group_commit
+        if self._pending_commits >= max_writes or monotonic() - self._pending_since >= max_delay:
+            self._commit()
+            return
+        if self._pending_commits > 1:
+            # keep one marker open, its work stays in the transaction
+            self.execute('RELEASE SAVEPOINT group_commit')
+        else:
+            # the marker must not open the transaction, releasing it would commit
+            self.begin()
+        self.execute('SAVEPOINT group_commit')
+
+    def flush_commits(self):
+        """Commit the work held back by group_commit"""
+        if self._pending_commits:
+            self._commit()
+
+    def _commit(self):
+        self._pending_commits = 0
         self._conn.commit()
+        self._invalidate_written()
+        self._emit('on_commit')
     
     def rollback(self):
-        self._conn.rollback()
+        if self.identity_map is not None:
+            self.identity_map.invalidate_all()
+        if self._pending_commits:
+            self.execute('ROLLBACK TO SAVEPOINT group_commit')
+            # work held back by group_commit is still not committed
+            self._invalidate_written(keep=True)
+        else:
+            self._conn.rollback()
+            self._invalidate_written()
     
     def close(self):
-        self._conn.close()
+        if self._conn is not None:
+            self.flush_commits()
+            self._conn.close()
+            self._conn = None
 
     @property
     def rowcount(self):
@@ -141,6 +680,32 @@ class BaseDatabase:
     def __del__(self):
         self.close()
         
+    @staticmethod
+    def limit_clause(limit, offset, placeholder):
+        """LIMIT / OFFSET with placeholders for the values which are set"""
+        if limit is not None:
+            sql = f'LIMIT {placeholder}'
+        else:
+            # OFFSET needs a LIMIT, this is the largest one MySQL accepts
+            sql = 'LIMIT 18446744073709551615'
+        if offset is not None:
+            sql += f' OFFSET {placeholder}'
+        return sql
+
+    @staticmethod
+    def seek_condition(columns, values, desc=False):
+        """
+        Keyset predicate selecting rows after values in the order of columns:
+        a > ? OR (a = ? AND b > ?) ...
+        """
+        operator = '<' if desc else '>'
+        clauses = list()
+        for i, column in enumerate(columns):
+            parts = [columns[j] == values[j] for j in range(i)]
+            parts.append(BinaryExpression(column, operator, values[i]))
+            clauses.append(and_(*parts) if len(parts) > 1 else parts[0])
+        return or_(*clauses) if len(clauses) > 1 else clauses[0]
+
     @staticmethod
     def table_schema(table_name, column_list):
         return f"CREATE TABLE IF NOT EXISTS {table_name} ({','.join(column_list)})"
@@ -170,6 +735,55 @@ class BaseDatabase:
         return f"CONSTRAINT fk_{column_full_name.replace('.', '_')} FOREIGN KEY({column_name}) REFERENCES {table_name}({owner_column})"
 
         
+class ResultSet:
+    """Cursor like access to rows served from a result cache"""
+
+    def __init__(self, names, rows):
+        self.description = tuple([(name, None, None, None, None, None, None) for name in names])
+        self.rowcount = len(rows)
+        self._rows = rows
+        self._pos = 0
+
+    def fetchall(self):
+        rows = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return rows
+
+    def fetchone(self):
+        if self._pos < len(self._rows):
+            self._pos += 1
+            return self._rows[self._pos - 1]
+
+    def fetchmany(self, size=1):
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+
+def _token_default(value):
+    """json encoding of key values json has no type for, tagged so they decode back"""
+    if isinstance(value, (datetime, date, time)):
+        return {'$type': type(value).__name__, 'value': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'$type': 'decimal', 'value': str(value)}
+    if isinstance(value, bytes):
+        return {'$type': 'bytes', 'value': urlsafe_b64encode(value).decode()}
+    raise TypeError(f'{type(value).__name__} can not be part of a continuation token')
+
+
+_token_types = {'datetime': datetime.fromisoformat,
+                'date': date.fromisoformat,
+                'time': time.fromisoformat,
+                'decimal': Decimal,
+                'bytes': lambda value: urlsafe_b64decode(value.encode())}
+
+
+def _token_object(obj):
+    if '$type' in obj:
+        return _token_types[obj['$type']](obj['value'])
+    return obj
+
+
 class BaseQuery:
     __db__ = None
 
@@ -180,65 +794,391 @@ class BaseQuery:
         self.model_columns = model.columns()
         self._where = list()
         self._order = list()
-        self._sql_base = ''
+        self._args = list()
         self.errors = None
 
     @property
-    def sql(self):
-        ret_sql = self._sql_base
+    def placeholder(self):
+        if self.__db__ is None:
+            return BaseDatabase.placeholder
+        return self.__db__.placeholder
+
+    @property
+    def dialect(self):
+        return type(self.__db__)
+
+    def compile(self):
+        """Return sql and arguments, reusing the model's cached sql for this query shape"""
+        key = self._shape()
+        cache = self.model.__statements__
+        args = list(self._args)
+        sql = cache.get(key)
+        if sql is None:
+            sql = self._render(self.placeholder, args)
+            cache.put(key, sql)
+        else:
+            self._collect(args)
+        return sql, tuple(args)
+
+    def _shape(self):
+        return (type(self).__name__,
+                self._base_shape(),
+                tuple([w.shape() for w in self._where]),
+                tuple([(_operand_shape(term), direction) for term, direction in self._order]),
+                self.dialect)
+
+    def _base_shape(self):
+        return None
+
+    def _base_sql(self):
+        return ''
+
+    def _render(self, placeholder, args):
+        return self._base_sql() + self._render_clauses(placeholder, args)
+
+    def _render_clauses(self, placeholder, args):
+        ret_sql = ''
         if self._where:
-            ret_sql += ' WHERE {}'.format(' AND '.join(self._where))
+            ret_sql += ' WHERE {}'.format(' AND '.join([w._compile(placeholder, args) for w in self._where]))
+        ret_sql += self._render_group(placeholder, args)
         if self._order:
-            ret_sql += ' ORDER BY {}'.format(','.join(self._order))
+            ret_sql += ' ORDER BY {}'.format(','.join([f'{_operand(term, placeholder, args)} {direction}'
+                                                       for term, direction in self._order]))
         return ret_sql
 
+    def _render_group(self, placeholder, args):
+        return ''
+
+    def _collect(self, args):
+        for w in self._where:
+            w._collect(args)
+        self._collect_group(args)
+        for term, direction in self._order:
+            _operand_collect(term, args)
+
+    def _collect_group(self, args):
+        pass
+
+    @property
+    def sql(self):
+        return self.compile()[0]
+
+    @property
+    def args(self):
+        return self.compile()[1]
+
+    def where(self, *conditions):
+        self._where.extend([as_expression(c) for c in conditions])
+        return self
+
 
 class Select(BaseQuery):
+    _prefetch = ()
+    _group = ()
+    _having = ()
+
     def __init__(self, model):
         super(Select, self).__init__(model)
-        self._sql_base = f"SELECT {','.join([c.column_full_name for c in self.model_columns])} FROM {model.table_name}"
+        self._columns = None
+        self._cache = False
+        self._cache_ttl = None
+        self._limit = None
+        self._offset = None
+        self._page_by = None
+
+    def _shape(self):
+        return super()._shape() + (self._limit is not None, self._offset is not None,
+                                   tuple([_operand_shape(g) for g in self._group]),
+                                   tuple([h.shape() for h in self._having]))
+
+    def _render(self, placeholder, args):
+        # selected expressions may bind values, they come before the where ones
+        sql = f'SELECT {self._select_list(placeholder, args)} FROM {self._from_sql(placeholder, args)}'
+        return sql + self._render_clauses(placeholder, args)
+
+    def _select_list(self, placeholder, args):
+        if self._columns is None:
+            return ','.join([c.column_full_name for c in self.model_columns])
+        return ','.join([_operand(c, placeholder, args) for c in self._columns])
+
+    def _from_sql(self, placeholder, args):
+        return self.model.table_name
+
+    def _render_clauses(self, placeholder, args):
+        ret_sql = super()._render_clauses(placeholder, args)
+        if self._limit is not None or self._offset is not None:
+            db = self.__db__ or BaseDatabase
+            ret_sql += ' ' + db.limit_clause(self._limit, self._offset, placeholder)
+            self._collect_limit(args)
+        return ret_sql
+
+    def _render_group(self, placeholder, args):
+        ret_sql = ''
+        if self._group:
+            ret_sql += ' GROUP BY {}'.format(','.join([str(g) for g in self._group]))
+        if self._having:
+            ret_sql += ' HAVING {}'.format(' AND '.join([h._compile(placeholder, args) for h in self._having]))
+        return ret_sql
+
+    def _collect(self, args):
+        for c in self._columns or ():
+            _operand_collect(c, args)
+        self._collect_from(args)
+        super()._collect(args)
+        self._collect_limit(args)
+
+    def _collect_group(self, args):
+        for h in self._having:
+            h._collect(args)
+
+    def _collect_from(self, args):
+        pass
+
+    def _collect_limit(self, args):
+        if self._limit is not None:
+            args.append(self._limit)
+        if self._offset is not None:
+            args.append(self._offset)
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def offset(self, offset):
+        self._offset = offset
+        return self
+
+    def page_after(self, last, by, desc=False):
+        """
+        Keyset pagination: order by the `by` columns and return only rows after
+        `last`, which is a model, a tuple of values or a token from page().
+        With last None the first page is returned. The `by` columns should
+        end with a unique one, usually the primary key.
+        """
+        self._page_by = list(by)
+        self.order_by(*self._page_by, desc=desc)
+        if last is None:
+            return self
+        if isinstance(last, str):
+            values = self.decode_token(last)
+        elif isinstance(last, BaseModel):
+            values = [getattr(last, c.column_name) for c in self._page_by]
+        else:
+            values = list(last)
+        if len(values) != len(self._page_by):
+            raise ValueError('page_after needs one value for every column in by')
+        db = self.__db__ or BaseDatabase
+        return self.where(db.seek_condition(self._page_by, values, desc))
+
+    def page(self):
+        """
+        Return (models, token) for a query set up with page_after and limit.
+        Pass token to page_after to get the next page, it is None on the last.
+        """
+        if self._page_by is None:
+            raise ValueError('page needs page_after to set the order')
+        rows = self.all()
+        token = None
+        if rows and self._limit and len(rows) >= self._limit:
+            token = self.encode_token([getattr(rows[-1], c.column_name) for c in self._page_by])
+        return rows, token
+
+    @staticmethod
+    def encode_token(values):
+        return urlsafe_b64encode(json.dumps(list(values), default=_token_default).encode()).decode()
+
+    @staticmethod
+    def decode_token(token):
+        try:
+            return json.loads(urlsafe_b64decode(token.encode()), object_hook=_token_object)
+        except (ValueError, KeyError, TypeError):
+            raise ValueError('invalid continuation token')
+
+    def _base_shape(self):
+        if self._columns is None:
+            return None
+        return tuple([_operand_shape(c) for c in self._columns])
+
+    def _base_sql(self):
+        columns = self.model_columns if self._columns is None else self._columns
+        return f"SELECT {','.join([c.column_full_name for c in columns])} FROM {self.model.table_name}"
 
     def get(self, model_id):
-            self.__db__.execute(f"{self._sql_base} WHERE {self._get_primary_key_name()} = '{model_id}'")
-            return self.__db__.fetchone(self.model)
+        identity_map = self.__db__.identity_map
+        if identity_map is not None and self._columns is None:
+            entity = identity_map.get(self.model, model_id)
+            if entity is None:
+                entity = self._get(model_id)
+                if entity is not None:
+                    identity_map.put(self.model, model_id, entity)
+            return entity
+        return self._get(model_id)
+
+    def _get(self, model_id):
+        key = ('get', self._base_shape(), self.dialect)
+        sql = self.model.__statements__.get(key)
+        if sql is None:
+            sql = f"{self._base_sql()} WHERE {self._get_primary_key_name()} = {self.placeholder}"
+            self.model.__statements__.put(key, sql)
+        self.__db__.execute(sql, (model_id,))
+        return self.__db__.fetchone(self.model)
     
     def _get_primary_key_name(self):
-        for c in self.model_columns:
-            if c.primary_key:
-                return c.column_name
+        if self.model.__primary_key__ is not None:
+            return self.model.__primary_key__.column_name
     
     def columns(self, *cols):
-        self._sql_base = f"SELECT {','.join([c.column_full_name for c in cols])} FROM {self.model.table_name}"
+        """Select only these columns or expressions, such as Users.user_id.count()"""
+        self._columns = cols
+        return self
+
+    def group_by(self, *columns):
+        self._group += columns
+        return self
+
+    def having(self, *conditions):
+        """Conditions on the groups, for example having(WorkDays.day.count() > 2)"""
+        self._having += tuple([as_expression(c) for c in conditions])
+        return self
+
+    def _scalar(self, sql, args):
+        if self._cache and self.__db__.result_cache is not None:
+            return self.__db__.fetch_scalar(self.__db__.execute_cached(sql, args, self._tables(), self._cache_ttl))
+        self.__db__.execute(sql, args)
+        return self.__db__.fetch_scalar()
+
+    def count(self):
+        """
+        Number of rows the query would return, counted by the database.
+        Grouped and limited queries are counted as a subquery.
+        """
+        if self._group or self._limit is not None or self._offset is not None:
+            sql, args = self.compile()
+            return self._scalar(f'SELECT COUNT(*) FROM ({sql}) AS counted', args)
+        return self._aggregate(count())
+
+    def exists(self):
+        """True when the query matches at least one row, the database stops at the first"""
+        sql, args = self.compile()
+        return bool(self._scalar(f'SELECT EXISTS ({sql})', args))
+
+    def sum(self, column):
+        return self._aggregate(column.sum())
+
+    def avg(self, column):
+        return self._aggregate(column.avg())
+
+    def min(self, column):
+        return self._aggregate(column.min())
+
+    def max(self, column):
+        return self._aggregate(column.max())
+
+    def aggregate(self, *expressions):
+        """
+        Values of aggregate expressions over all matching rows as one tuple:
+
+            total, longest = db.select(Users).aggregate(count(), Users.login.max())
+        """
+        return self._aggregate(*expressions, row=True)
+
+    def _aggregate(self, *expressions, row=False):
+        if self._group or self._limit is not None or self._offset is not None:
+            raise ValueError('use columns() with group_by() for grouped or limited aggregates')
+        query = copy(self)
+        query._columns = expressions
+        query._order = list()
+        if row:
+            return query.tuples()[0]
+        return query.first_scalar()
+
+    def cache(self, ttl=None):
+        """Serve this query from the connection's result cache, see BaseDatabase.use_result_cache"""
+        self._cache = True
+        self._cache_ttl = ttl
+        return self
+
+    def _execute(self):
+        """Run the query and return the cursor holding its rows"""
+        sql, args = self.compile()
+        if self._cache and self.__db__.result_cache is not None:
+            return self.__db__.execute_cached(sql, args, self._tables(), self._cache_ttl)
+        self.__db__.execute(sql, args)
+        return self.__db__._cur
+
+    def _tables(self):
+        return (self.model.table_name,)
+
+    def prefetch(self, *columns):
+        """
+        Load related rows of all(), one() and many() results through the
+        foreign key columns, see BaseDatabase.prefetch.
+
+            for day in db.select(WorkDays).prefetch(WorkDays.user_id).all():
+                print(day.related(WorkDays.user_id).login)
+        """
+        self._prefetch += columns
         return self
 
+    select_related = prefetch
+
     def all(self):
-        self.__db__.execute(self.sql)
-        return self.__db__.fetch(self.model)
+        rows = self.__db__.fetch(self._result_model(), self._execute())
+        if self._prefetch:
+            self.__db__.prefetch(rows, *self._prefetch)
+        return rows
 
     def one(self):
-        self.__db__.execute(self.sql)
-        return  self.__db__.fetchone(self.model)
+        row = self.__db__.fetchone(self._result_model(), self._execute())
+        if self._prefetch and row is not None:
+            self.__db__.prefetch([row], *self._prefetch)
+        return row
     
     def many(self, size):
-        self.__db__.execute(self.sql)
-        return self.__db__.fetchmany(self.model, size)
+        rows = self.__db__.fetchmany(self._result_model(), size, self._execute())
+        if self._prefetch:
+            self.__db__.prefetch(rows, *self._prefetch)
+        return rows
 
-    def where(self, *conditions):
-        self._where.extend(conditions)
-        return self
+    def tuples(self):
+        """Rows as returned by the driver, without building models"""
+        return self.__db__.fetch_tuples(self._execute())
+
+    def dicts(self):
+        """Rows as dicts keyed on the result column names"""
+        return self.__db__.fetch_dicts(self._execute())
+
+    def scalars(self):
+        """Values of the first selected column"""
+        return self.__db__.fetch_scalars(self._execute())
+
+    def first_scalar(self):
+        """Value of the first column in the first row or None"""
+        return self.__db__.fetch_scalar(self._execute())
+
+    def iter(self, batch_size=1000):
+        """Generator over the results, fetched and prefetched in batches of batch_size rows"""
+        if self._prefetch and not self.__db__.query_while_streaming:
+            raise ValueError(f'{type(self.__db__).__name__} can not prefetch while streaming, use all() or many()')
+        return self.__db__.iterate(self._result_model(), *self.compile(), batch_size=batch_size,
+                                   prefetch=self._prefetch)
+
+    def __iter__(self):
+        return self.iter()
+
+    def _result_model(self):
+        return self.model
 
     def order_by(self, *columns, desc=False):
+        """Order by columns, expressions such as count(), labels by their name, or raw sql strings"""
         for order_column in columns:
-            col = ''
-            if isinstance(order_column, Column):
-                col = order_column.column_full_name
-            elif type(order_column) == str:
-                col = order_column
-            if desc:
-                col += ' DESC'
-            else:
-                col += ' ASC'
-            self._order.append(col)
+            if isinstance(order_column, str):
+                order_column = Text(order_column)
+            elif isinstance(order_column, Label):
+                order_column = Text(order_column.name)
+            elif not isinstance(order_column, (Column, Expression)):
+                raise ValueError(f'can not order by {type(order_column).__name__}')
+            self._order.append((order_column, 'DESC' if desc else 'ASC'))
 
         return self
 
@@ -246,79 +1186,162 @@ class Select(BaseQuery):
 class Insert(BaseQuery):
     def __init__(self, model):
         super(Insert, self).__init__(model)
+        self._names = list()
+        self._conflict = None
+        self._update = None
+        self._get_column_and_values()
 
-        self._sql_base = f'INSERT INTO {model.table_name} {self._get_column_and_values()}'
-        # self.errors = self.__db__.execute(self.sql)
+    def on_conflict(self, conflict, update=None):
+        """
+        Turn the insert into an upsert, see BaseDatabase.upsert_many.
+        :param conflict: columns of the unique key the row may clash on
+        :param update: columns overwritten on a clash, None for all inserted ones
+        """
+        self._conflict = tuple([c.column_name for c in conflict])
+        if not self._conflict:
+            raise ValueError('conflict columns are needed')
+        if update is None:
+            pk = self.model.__primary_key__
+            skip = set(self._conflict)
+            if pk is not None:
+                skip.add(pk.column_name)
+            self._update = tuple([name for name in self._names if name not in skip])
+        else:
+            self._update = tuple([c.column_name for c in update])
+            for name in self._update:
+                if name not in self._names:
+                    raise ValueError(f'{name}: updated column has no value')
+        return self
 
     def _get_column_and_values(self):
         #TODO add check if columnt is nullable
-        values = list()
-        names = list()
-        for c in self.model_columns:
-            val = getattr(self.model, c.column_name)
-            if not isinstance(val, Column):
-                names.append(c.column_name)
-                values.append(f"'{val}'")
-        return f"({','.join(names)}) VALUES ({','.join(values)})"
+        for c, val in self.model._values():
+            self._names.append(c.column_name)
+            self._args.append(val)
+
+    def _base_shape(self):
+        if self._conflict is None:
+            return tuple(self._names)
+        return (tuple(self._names), self._conflict, self._update)
+
+    def _base_sql(self, rows=1):
+        values = ','.join([self.placeholder] * len(self._names))
+        values = ','.join([f'({values})'] * rows)
+        sql = f"INSERT INTO {self.model.table_name} ({','.join(self._names)}) VALUES {values}"
+        if self._conflict is not None:
+            sql += (self.__db__ or BaseDatabase).upsert_clause(self._conflict, self._update)
+        return sql
+
+    def multirow_sql(self, rows):
+        """Sql inserting `rows` rows of this insert's shape in one statement"""
+        key = ('multirow', self._base_shape(), rows, self.dialect)
+        sql = self.model.__statements__.get(key)
+        if sql is None:
+            sql = self._base_sql(rows)
+            self.model.__statements__.put(key, sql)
+        return sql
     
     def do(self):
-        self.errors = self.__db__.execute(self.sql)
+        self.errors = self.__db__.execute(*self.compile())
+        self.__db__._invalidate(self.model.table_name)
         return self.__db__.rowcount
 
 
 class Update(BaseQuery):
     def __init__(self, model):
         super(Update, self).__init__(model)
-        self._sql_base = f"UPDATE {model.table_name} SET {self._get_column_and_values()}"
+        self._names = list()
+        self._get_column_and_values()
 
     def do(self):
-        self.errors = self.__db__.execute(self.sql)
+        if not self._names:
+            # nothing changed since the model was loaded
+            return 0
+        self.errors = self.__db__.execute(*self.compile())
+        self.__db__._invalidate(self.model.table_name)
+        if not self.errors:
+            self.model._mark_clean()
         return self.__db__.rowcount
 
-    def where(self, *conditions):
-        self._where.extend(conditions)
-        return self
-
     def _get_column_and_values(self):
-        values = list()
-        for c in self.model_columns:
-            val = getattr(self.model, c.column_name)
-            if not isinstance(val, Column):
-                values.append("{} = '{}'".format(c.column_full_name,val))
-        return ','.join(values)
+        for c, val in self.model._changes():
+            self._names.append(c.column_name)
+            self._args.append(val)
 
+    def _base_shape(self):
+        return tuple(self._names)
 
-class Delete(BaseQuery):
-    def __init__(self, model):
-        super(Delete, self).__init__(model)
-        self._sql_base = f'DELETE FROM {model.table_name}'
+    def _base_sql(self):
+        values = ','.join([f'{name} = {self.placeholder}' for name in self._names])
+        return f"UPDATE {self.model.table_name} SET {values}"
 
-    def where(self, *conditions):
-        self._where.extend(conditions)
-        return self
+
+class Delete(BaseQuery):
+    def _base_sql(self):
+        return f'DELETE FROM {self.model.table_name}'
 
     def do(self):
-        self.__db__.execute(self.sql)
+        self.errors = self.__db__.execute(*self.compile())
+        self.__db__._invalidate(self.model.table_name)
         return self.__db__.rowcount
 
 
 class Join(Select):
     def __init__(self, *models):
+        self.model = BaseModel
         self.model_columns = list()
+        self._columns = None
+        self._cache = False
+        self._cache_ttl = None
+        self._limit = None
+        self._offset = None
+        self._page_by = None
         self._joins = list()
         self._where = list()
         self._order = list()
+        self._args = list()
+        self.errors = None
         for item in models:
             if isinstance(item, Column):
                 self.model_columns.append(item)
             elif isinstance(item, BaseModel) or isinstance(item, MetaBaseModel):
                 for col in item.columns():
                     self.model_columns.append(col)
+        if self.model_columns:
+            self.model = self.model_columns[0].model
 
-        self._sql_base = 'SELECT {} FROM {}'.format(
-                ','.join(['{} AS {}'.format(c.column_full_name,
-                                            self._get_column_alias(c.column_full_name)) for c in self.model_columns]),
-                self._get_table_name())
+    def _base_shape(self):
+        return tuple(self.model_columns), super()._base_shape()
+
+    def _select_list(self, placeholder, args):
+        if self._columns is not None:
+            return super()._select_list(placeholder, args)
+        return ','.join(['{} AS {}'.format(c.column_full_name, self._get_column_alias(c.column_full_name))
+                         for c in self.model_columns + self._markers()])
+
+    def _markers(self):
+        """
+        Primary keys of the models on the outer side of a join which are not
+        selected, they tell a missing row from a row with NULL values.
+        """
+        nullable = self._nullable_tables()
+        markers = list()
+        for model in dict.fromkeys([c.model for c in self.model_columns]):
+            pk = model.__primary_key__
+            if model.table_name in nullable and pk is not None and not any([c is pk for c in self.model_columns]):
+                markers.append(pk)
+        return markers
+
+    def _from_sql(self, placeholder, args):
+        ret_sql = self._get_table_name()
+        if self._joins:
+            ret_sql += ' '
+            ret_sql += ' '.join([f'{join} ON {cond._compile(placeholder, args)}' for join, cond in self._joins])
+        return ret_sql
+
+    def _collect_from(self, args):
+        for join, cond in self._joins:
+            cond._collect(args)
 
     @staticmethod
     def _get_column_alias(column_name):
@@ -332,38 +1355,153 @@ class Join(Select):
         return full_name.split('.', 1)[0]
 
     def inner(self, table_name, condition):
+        return self._join('INNER JOIN', table_name, condition)
+
+    def left(self, table_name, condition):
+        """LEFT OUTER JOIN, models of table_name are None in rows without a match"""
+        return self._join('LEFT OUTER JOIN', table_name, condition)
+
+    def right(self, table_name, condition):
+        """RIGHT OUTER JOIN, needs sqlite >= 3.39"""
+        return self._join('RIGHT OUTER JOIN', table_name, condition)
+
+    def full(self, table_name, condition):
+        """FULL OUTER JOIN, needs sqlite >= 3.39, MySQL has none"""
+        return self._join('FULL OUTER JOIN', table_name, condition)
+
+    def _join(self, kind, table_name, condition):
         if isinstance(table_name, BaseModel) or isinstance(table_name, MetaBaseModel):
             table_name = table_name.table_name
-        self._joins.append('INNER JOIN {} ON {}'.format(table_name, condition))
+        self._joins.append((f'{kind} {table_name}', as_expression(condition)))
         return self
 
-    def all(self):
-        self.__db__.execute(self.sql)
-        func = {}
-        for c in self.model_columns:
-            print(self._get_column_alias(c.column_full_name))
-            func[self._get_column_alias(c.column_full_name)] = Column(String())
+    def _tables(self):
+        tables = [c.model.table_name for c in self.model_columns]
+        tables.extend([join.split()[-1] for join, cond in self._joins])
+        return tuple(dict.fromkeys(tables))
 
-        Model = type('Model', (BaseModel,), func)
+    def _nullable_tables(self):
+        """Tables which outer joins may leave without a row"""
+        tables = [self._get_table_name()]
+        nullable = set()
+        for join, cond in self._joins:
+            table = join.split()[-1]
+            if join.startswith(('LEFT', 'FULL')):
+                nullable.add(table)
+            if join.startswith(('RIGHT', 'FULL')):
+                nullable.update(tables)
+            tables.append(table)
+        return frozenset(nullable)
 
-        return self.__db__.fetch(Model)
+    def _result_model(self):
+        if self._columns is not None:
+            raise ValueError('rows of Join.columns() are not models, fetch them with tuples(), dicts() or scalars()')
+        key = (tuple(self.model_columns), self._nullable_tables())
+        result = _join_results.get(key)
+        if result is None:
+            result = JoinResult(self.model_columns, key[1])
+            _join_results.put(key, result)
+        return result
+
+    def _shape(self):
+        return super()._shape() + (tuple([(join, cond.shape()) for join, cond in self._joins]),)
+
+
+class JoinResult:
+    """
+    Stands in for a model when fetching Join rows, rows become tuples with
+    one instance per joined model, in the order the models were given.
+    One is kept per join shape, see Join._result_model.
+    """
+
+    def __init__(self, columns, nullable=frozenset()):
+        self.columns = tuple(columns)
+        self.models = tuple(dict.fromkeys([c.model for c in columns]))
+        self.nullable = nullable
+        self.__name__ = ','.join([m.__name__ for m in self.models])
+        self.__hydrators__ = LRUCache(8)
+
+    def _build_hydrator(self, names):
+        """
+        Compile one function building all instances of a row, with the same
+        fields and _loaded snapshot the model hydrators give them.
+        """
+        lines = ['def hydrate(row):']
+        namespace = {'new': object.__new__}
+        results = list()
+        for n, model in enumerate(self.models):
+            positions = list()
+            attrs = list()
+            for c in self.columns:
+                if c.model is model:
+                    positions.append(names.index(Join._get_column_alias(c.column_full_name)))
+                    attrs.append(c.column_name)
+            missing = [c.column_name for c in model.columns() if c.column_name not in attrs]
+            namespace[f'model{n}'] = model
+            namespace[f'attrs{n}'] = tuple(attrs)
+            loaded = f"(attrs{n}, ({''.join([f'row[{idx}],' for idx in positions])}))"
+
+            indent = '    '
+            if model.table_name in self.nullable:
+                # no match on the outer side of the join, the primary key is
+                # always selected for it, see Join._markers
+                pk = model.__primary_key__
+                if pk is not None:
+                    empty = f'row[{names.index(Join._get_column_alias(pk.column_full_name))}] is None'
+                else:
+                    empty = ' and '.join([f'row[{idx}] is None' for idx in positions])
+                lines.extend([f'    if {empty}:', f'        obj{n} = None', '    else:'])
+                indent = '        '
+            lines.append(f'{indent}obj{n} = new(model{n})')
+            if model.__compact__:
+                lines.extend([f'{indent}obj{n}.{name} = row[{idx}]' for idx, name in zip(positions, attrs)])
+                lines.extend([f'{indent}obj{n}.{name} = None' for name in missing])
+                lines.append(f'{indent}obj{n}._loaded = {loaded}')
+            else:
+                fields = [f'{name!r}: row[{idx}]' for idx, name in zip(positions, attrs)]
+                fields.extend([f'{name!r}: None' for name in missing])
+                fields.append(f"'_loaded': {loaded}")
+                lines.append(f"{indent}obj{n}.__dict__ = {{{', '.join(fields)}}}")
+            results.append(f'obj{n},')
+        lines.append(f"    return ({' '.join(results)})")
+        exec('\n'.join(lines), namespace)
+        return namespace['hydrate']
+
+
+_join_results = LRUCache(256)
 
-    @property
-    def sql(self):
-        ret_sql = self._sql_base
-        if self._joins:
-            ret_sql += ' '
-            ret_sql += ' '.join(self._joins)
-        if self._where:
-            ret_sql += f" WHERE {' AND '.join(self._where)}"
-        if self._order:
-            ret_sql += f" ORDER BY {','.join(self._order)}"
-        return ret_sql
+
+def related_column(column):
+    """Column a foreign key column refers to"""
+    if not column.foreignkey:
+        raise ValueError(f'{column.column_full_name} is not a foreign key')
+    table_name, column_name = column.foreignkey.split('.', 1)
+    model = model_registry.get(table_name)
+    if model is None:
+        raise ValueError(f'no model for table {table_name}')
+    target = getattr(model, column_name, None)
+    if not isinstance(target, Column):
+        raise ValueError(f'{model.__name__} has no column {column_name}')
+    return target
 
 
 class MetaBaseModel(type):
 
-    def __new__(mcs, name, bases, attrs):
+    def __new__(mcs, name, bases, attrs, compact=False):
+        fields = dict()
+        if compact:
+            # slots take the column names, Column objects are served by CompactMetaBaseModel
+            for obj_name, obj in list(attrs.items()):
+                if not obj_name.startswith('_') and isinstance(obj, Column):
+                    fields[obj_name] = attrs.pop(obj_name)
+            attrs['__slots__'] = tuple(attrs.get('__slots__', ())) + tuple(fields)
+            if not any([getattr(b, '__compact__', False) for b in bases]):
+                # snapshot of the loaded row and prefetched rows, see BaseModel._changes and related
+                attrs['__slots__'] += ('_loaded', '_related')
+            attrs['__compact__'] = True
+            attrs['__fields__'] = fields
+            mcs = CompactMetaBaseModel
+
         result = type.__new__(mcs, name, bases, attrs)
         result.columns_obj = list()
 
@@ -374,12 +1512,21 @@ class MetaBaseModel(type):
             table_name += c
         result.table_name = table_name.lower()
 
-        for obj_name in attrs:
+        result.__primary_key__ = None
+        for obj_name in list(attrs) + list(fields):
             obj = getattr(result, obj_name)
             if not obj_name.startswith('_') and isinstance(obj, Column):
                 obj.column_name = obj_name
                 obj.column_full_name = '{}.{}'.format(result.table_name, obj_name)
+                obj.model = result
                 result.columns_obj.append(obj)
+                if obj.primary_key and result.__primary_key__ is None:
+                    result.__primary_key__ = obj
+
+        # compiled sql keyed on the query shape, see BaseQuery.compile
+        result.__statements__ = LRUCache(getattr(result, '__statement_cache_size__', 256))
+        # row hydrators keyed on result column names, see BaseDatabase._hydrator
+        result.__hydrators__ = LRUCache(32)
 
         table_name = ''
         for i, c in enumerate(name):
@@ -387,15 +1534,148 @@ class MetaBaseModel(type):
                 table_name += '_'
             table_name += c
         result.table_name = table_name.lower()
+        if result.columns_obj:
+            model_registry[result.table_name] = result
         return result
+
+
+class CompactMetaBaseModel(MetaBaseModel):
+    """
+    Metaclass of models declared with compact=True. Instances keep their values
+    in __slots__ named after the columns, so class level access has to be
+    redirected to the Column objects used to build queries.
+    """
+
+    def __getattribute__(cls, name):
+        column = type.__getattribute__(cls, '__fields__').get(name)
+        if column is not None:
+            return column
+        return type.__getattribute__(cls, name)
     
     
 class BaseModel(metaclass=MetaBaseModel):
+    __slots__ = ()
+    __statement_cache_size__ = 256
+    __compact__ = False
+    __fields__ = dict()
+
     @classmethod
     def columns(cls):
         return cls.columns_obj
-    
+
+    @classmethod
+    def indexes(cls):
+        """Indexes of Column(index=True) columns followed by the ones in __indexes__"""
+        ret = [Index(c) for c in cls.columns() if c.index and not c.primary_key and not c.unique]
+        ret.extend(getattr(cls, '__indexes__', ()))
+        return ret
+
+    def _values(self):
+        """Columns with a value set on this instance, as (column, value) pairs"""
+        if self.__compact__:
+            ret = list()
+            for c in self.columns():
+                val = getattr(self, c.column_name)
+                if val is not UNSET:
+                    ret.append((c, val))
+            return ret
+        fields = self.__dict__
+        return [(c, fields[c.column_name]) for c in self.columns() if c.column_name in fields]
+
+    def _changes(self):
+        """
+        Columns changed since the instance was loaded or _mark_clean was
+        called, as (column, value) pairs. All set columns for new instances.
+        """
+        loaded = getattr(self, '_loaded', None)
+        if loaded is None:
+            return self._values()
+        before = dict(zip(*loaded))
+        ret = list()
+        for c, val in self._values():
+            old = before.get(c.column_name)
+            if val is not old and val != old:
+                ret.append((c, val))
+        return ret
+
+    def related(self, column):
+        """
+        Row attached by prefetch through the foreign key column, or the list
+        of rows of another model referring to this one through column.
+        """
+        try:
+            return self._related[column.column_full_name]
+        except (AttributeError, KeyError):
+            raise LookupError(f'{column.column_full_name} was not prefetched') from None
+
+    def _attach(self, column, value):
+        related = getattr(self, '_related', None)
+        if related is None:
+            related = self._related = dict()
+        related[column.column_full_name] = value
+
+    def _mark_clean(self):
+        """Take the current values as the unchanged state"""
+        values = self._values()
+        self._loaded = (tuple([c.column_name for c, val in values]), tuple([val for c, val in values]))
+
+    @classmethod
+    def _build_hydrator(cls, names):
+        """
+        Return a function turning a row with the given column names into
+        a model instance. Positions are resolved here once, the instance is
+        created without __init__ and columns missing from the row are None.
+        """
+        columns = [c.column_name for c in cls.columns()]
+        positions = [idx for idx, name in enumerate(names) if name in columns]
+        attrs = tuple([names[idx] for idx in positions])
+        missing = {name: None for name in columns if name not in attrs}
+        new = object.__new__
+
+        if positions == list(range(len(names))):
+            def values(row):
+                return row
+        elif len(positions) == 1:
+            position = positions[0]
+
+            def values(row):
+                return (row[position],)
+        else:
+            values = itemgetter(*positions)
+
+        if cls.__compact__:
+            return cls._build_compact_hydrator(positions, attrs, missing, values)
+
+        def hydrate(row):
+            obj = new(cls)
+            loaded = values(row)
+            fields = dict(zip(attrs, loaded))
+            if missing:
+                fields.update(missing)
+            fields['_loaded'] = (attrs, loaded)
+            obj.__dict__ = fields
+            return obj
+
+        return hydrate
+
+    @classmethod
+    def _build_compact_hydrator(cls, positions, attrs, missing, values):
+        # slot stores compiled into one function, names are python identifiers
+        lines = ['def hydrate(row):', '    obj = new(cls)']
+        for idx, name in zip(positions, attrs):
+            lines.append(f'    obj.{name} = row[{idx}]')
+        for name in missing:
+            lines.append(f'    obj.{name} = None')
+        lines.append('    obj._loaded = (attrs, values(row))')
+        lines.append('    return obj')
+        namespace = {'new': object.__new__, 'cls': cls, 'attrs': attrs, 'values': values}
+        exec('\n'.join(lines), namespace)
+        return namespace['hydrate']
+
     def __init__(self, **args):
+        if self.__compact__:
+            for name in self.__fields__:
+                setattr(self, name, UNSET)
         for k in args:
             if hasattr(self, k):
                 setattr(self, k, args[k])
@@ -0,0 +1,314 @@
+# Copyright 2019 AngrySoft Sebastian Zwierzchowski
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from collections import OrderedDict
+from threading import Lock
+from time import time
+import pickle
+import sqlite3
+
+
+class LRUCache:
+    """Bounded mapping which drops the least recently used entry when full"""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+class IdentityMap:
+    """
+    Bounded cache of model instances keyed on (model, primary key).
+
+    Invalidating a table bumps its generation, which is part of the key, so
+    stale entries are never returned and fall out of the LRU on their own.
+    """
+
+    def __init__(self, maxsize=1024):
+        self._entities = LRUCache(maxsize)
+        self._generations = dict()
+        self._epoch = 0
+
+    def _key(self, model, model_id):
+        return (model, self._epoch, self._generations.get(model.table_name, 0), model_id)
+
+    def get(self, model, model_id):
+        return self._entities.get(self._key(model, model_id))
+
+    def put(self, model, model_id, entity):
+        self._entities.put(self._key(model, model_id), entity)
+
+    def invalidate(self, table_name):
+        self._generations[table_name] = self._generations.get(table_name, 0) + 1
+
+    def invalidate_all(self):
+        self._epoch += 1
+
+    @property
+    def hits(self):
+        return self._entities.hits
+
+    @property
+    def misses(self):
+        return self._entities.misses
+
+    def info(self):
+        return self._entities.info()
+
+    def __len__(self):
+        return len(self._entities)
+
+
+class ResultCache:
+    """
+    Interface of result cache backends used by BaseDatabase.execute_cached.
+    Values are (column names, rows) pairs, keys are (sql, args) pairs.
+    """
+    ttl = 60
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def put(self, key, value, tables, ttl=None):
+        raise NotImplementedError
+
+    def invalidate(self, table_name):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryResultCache(ResultCache):
+    """In process result cache with ttl, a memory limit and LRU eviction"""
+
+    def __init__(self, maxsize=1024, max_bytes=64 * 1024 * 1024, ttl=60):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._data = OrderedDict()
+        self._tables = dict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, size, value, tables = entry
+            if expires < time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, tables, ttl=None):
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        expires = time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (expires, size, value, tables)
+            self.size += size
+            for table in tables:
+                self._tables.setdefault(table, set()).add(key)
+            while len(self._data) > self.maxsize or self.size > self.max_bytes:
+                self._remove(next(iter(self._data)))
+
+    def invalidate(self, table_name):
+        with self._lock:
+            for key in list(self._tables.pop(table_name, ())):
+                if key in self._data:
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tables.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        expires, size, value, tables = self._data.pop(key)
+        self.size -= size
+        for table in tables:
+            keys = self._tables.get(table)
+            if keys is not None:
+                keys.discard(key)
+
+    def info(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._data),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes}
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteResultCache(ResultCache):
+    """
+    Result cache kept in a sqlite file, so several worker processes pointed at
+    the same file share cached results and invalidations. Only use a file
+    trusted by all workers, entries are pickled.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, ttl=60, timeout=5.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # last use of entries hit since the last put, hits stay read only
+        self._used = dict()
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                           'key BLOB PRIMARY KEY, value BLOB, size INTEGER, expires REAL, used REAL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS entry_tables (key BLOB, table_name TEXT)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entry_tables_table ON entry_tables (table_name)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entry_tables_key ON entry_tables (key)')
+
+    @staticmethod
+    def _key(key):
+        return pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+
+    def get(self, key):
+        key = self._key(key)
+        now = time()
+        with self._lock:
+            row = self._conn.execute('SELECT value, expires FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] < now:
+                self.misses += 1
+                return None
+            self._used[key] = now
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, key, value, tables, ttl=None):
+        key = self._key(key)
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(value) > self.max_bytes:
+            return
+        now = time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute('DELETE FROM entry_tables WHERE key = ?', (key,))
+                self._conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                                   (key, value, len(value), expires, now))
+                self._conn.executemany('INSERT INTO entry_tables VALUES (?, ?)', [(key, t) for t in tables])
+                if self._used:
+                    self._conn.executemany('UPDATE entries SET used = ? WHERE key = ?',
+                                           [(used, k) for k, used in self._used.items()])
+                    self._used.clear()
+                self._evict(now)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def _evict(self, now):
+        removed = self._conn.execute('DELETE FROM entries WHERE expires < ?', (now,)).rowcount
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total > self.max_bytes:
+            for key, size in self._conn.execute('SELECT key, size FROM entries ORDER BY used').fetchall():
+                self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                removed += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        if removed:
+            self._conn.execute('DELETE FROM entry_tables WHERE key NOT IN (SELECT key FROM entries)')
+
+    def invalidate(self, table_name):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.execute('DELETE FROM entries WHERE key IN '
+                               '(SELECT key FROM entry_tables WHERE table_name = ?)', (table_name,))
+            self._conn.execute('DELETE FROM entry_tables WHERE table_name = ?', (table_name,))
+            self._conn.execute('COMMIT')
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM entries')
+            self._conn.execute('DELETE FROM entry_tables')
+
+    def info(self):
+        with self._lock:
+            entries, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes}
+
+    def close(self):
+        self._conn.close()
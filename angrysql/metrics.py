@@ -0,0 +1,200 @@
+# Copyright 2019 AngrySoft Sebastian Zwierzchowski
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from bisect import bisect_left
+from functools import lru_cache
+from threading import Lock
+from weakref import WeakKeyDictionary
+import re
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_table_patterns = {'SELECT': re.compile(r'\bFROM\s+[`"]?(\w+)', re.I),
+                   'DELETE': re.compile(r'\bFROM\s+[`"]?(\w+)', re.I),
+                   'INSERT': re.compile(r'\bINTO\s+[`"]?(\w+)', re.I),
+                   'REPLACE': re.compile(r'\bINTO\s+[`"]?(\w+)', re.I),
+                   'UPDATE': re.compile(r'^\s*UPDATE\s+[`"]?(\w+)', re.I),
+                   'CREATE': re.compile(r'\b(?:TABLE|ON)\s+(?:IF\s+NOT\s+EXISTS\s+)?[`"]?(\w+)', re.I)}
+
+
+@lru_cache(maxsize=1024)
+def statement_labels(sql):
+    """(kind, table) of a statement, for example ('SELECT', 'users')"""
+    words = sql.split(None, 1)
+    if not words:
+        return ('OTHER', '')
+    kind = words[0].upper()
+    pattern = _table_patterns.get(kind)
+    if pattern is None:
+        return (kind, '')
+    match = pattern.search(sql)
+    return (kind, match.group(1) if match else '')
+
+
+class _Series:
+    __slots__ = ('statements', 'errors', 'seconds', 'rows_affected', 'rows_fetched', 'buckets')
+
+    def __init__(self, size):
+        self.statements = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.rows_affected = 0
+        self.rows_fetched = 0
+        self.buckets = [0] * (size + 1)
+
+
+class Metrics:
+    """
+    Statement metrics collected from connection hooks, labelled by statement
+    kind and table. One registry can be attached to many connections.
+
+        metrics = db.use_metrics()
+        ...
+        print(metrics.prometheus())
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='angrysql'):
+        self.bucket_bounds = tuple(sorted(buckets))
+        self.prefix = prefix
+        self.commits = 0
+        self.hydrated = dict()
+        self._series = dict()
+        self._last = WeakKeyDictionary()
+        self._lock = Lock()
+
+    def attach(self, db):
+        db.on('after_execute', self._after_execute)
+        db.on('on_error', self._on_error)
+        db.on('after_fetch', self._after_fetch)
+        db.on('on_hydrate', self._on_hydrate)
+        db.on('on_commit', self._on_commit)
+
+    def detach(self, db):
+        db.off('after_execute', self._after_execute)
+        db.off('on_error', self._on_error)
+        db.off('after_fetch', self._after_fetch)
+        db.off('on_hydrate', self._on_hydrate)
+        db.off('on_commit', self._on_commit)
+
+    def _get(self, labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = _Series(len(self.bucket_bounds))
+        return series
+
+    def _observe(self, db, sql, duration):
+        labels = statement_labels(sql)
+        self._last[db] = labels
+        series = self._get(labels)
+        series.statements += 1
+        series.seconds += duration
+        series.buckets[bisect_left(self.bucket_bounds, duration)] += 1
+        return series
+
+    def _after_execute(self, db, sql, args, duration, rowcount):
+        with self._lock:
+            series = self._observe(db, sql, duration)
+            if rowcount > 0:
+                series.rows_affected += rowcount
+
+    def _on_error(self, db, sql, args, duration, error):
+        with self._lock:
+            self._observe(db, sql, duration).errors += 1
+
+    def _after_fetch(self, db, count):
+        with self._lock:
+            self._get(self._last.get(db, ('OTHER', ''))).rows_fetched += count
+
+    def _on_hydrate(self, db, model, instances):
+        with self._lock:
+            self.hydrated[model.__name__] = self.hydrated.get(model.__name__, 0) + len(instances)
+
+    def _on_commit(self, db):
+        with self._lock:
+            self.commits += 1
+
+    def reset(self):
+        with self._lock:
+            self.commits = 0
+            self.hydrated.clear()
+            self._series.clear()
+
+    def to_dict(self):
+        with self._lock:
+            statements = list()
+            for (kind, table), series in sorted(self._series.items()):
+                cumulative = 0
+                buckets = dict()
+                for bound, count in zip(self.bucket_bounds + (float('inf'),), series.buckets):
+                    cumulative += count
+                    buckets[bound] = cumulative
+                statements.append({'kind': kind,
+                                   'table': table,
+                                   'statements': series.statements,
+                                   'errors': series.errors,
+                                   'seconds': series.seconds,
+                                   'rows_affected': series.rows_affected,
+                                   'rows_fetched': series.rows_fetched,
+                                   'latency': buckets})
+            return {'statements': statements,
+                    'commits': self.commits,
+                    'hydrated': dict(self.hydrated)}
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        data = self.to_dict()
+        p = self.prefix
+        lines = list()
+        counters = (('statements', 'statements_total', 'Statements executed.'),
+                    ('errors', 'statement_errors_total', 'Statements which failed.'),
+                    ('seconds', 'statement_seconds_total', 'Time spent executing statements.'),
+                    ('rows_affected', 'rows_affected_total', 'Rows changed by statements.'),
+                    ('rows_fetched', 'rows_fetched_total', 'Rows fetched from results.'))
+        for key, name, help_text in counters:
+            lines.append(f'# HELP {p}_{name} {help_text}')
+            lines.append(f'# TYPE {p}_{name} counter')
+            for s in data['statements']:
+                lines.append(f'{p}_{name}{{{_labels(s)}}} {_number(s[key])}')
+
+        name = f'{p}_statement_duration_seconds'
+        lines.append(f'# HELP {name} Statement latency.')
+        lines.append(f'# TYPE {name} histogram')
+        for s in data['statements']:
+            labels = _labels(s)
+            for bound, count in s['latency'].items():
+                le = '+Inf' if bound == float('inf') else _number(bound)
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+            lines.append(f'{name}_sum{{{labels}}} {_number(s["seconds"])}')
+            lines.append(f'{name}_count{{{labels}}} {s["statements"]}')
+
+        lines.append(f'# HELP {p}_commits_total Transactions committed.')
+        lines.append(f'# TYPE {p}_commits_total counter')
+        lines.append(f'{p}_commits_total {data["commits"]}')
+
+        lines.append(f'# HELP {p}_models_hydrated_total Model instances built from rows.')
+        lines.append(f'# TYPE {p}_models_hydrated_total counter')
+        for model, count in sorted(data['hydrated'].items()):
+            lines.append(f'{p}_models_hydrated_total{{model="{_escape(model)}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(series):
+    return f'kind="{_escape(series["kind"])}",table="{_escape(series["table"])}"'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
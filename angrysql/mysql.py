@@ -12,22 +12,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import MySQLdb
+import MySQLdb.cursors
 import warnings
+import sys
 from .base import BaseDatabase
 
 class MySqlConnection(BaseDatabase):
-    def __init__(self, user, database, password='', charset='utf8', echo=False):
+    placeholder = '%s'
+    max_placeholders = 65535
+    max_packet = 4 * 1024 * 1024
+    driver_errors = (MySQLdb.Error,)
+    # the unbuffered cursor of iterate blocks the connection until it is read
+    query_while_streaming = False
+
+    def __init__(self, user, dbname, password='', host='localhost', port=None, charset='utf8', echo=False):
         """
         Create a connection to the database.
-        :param config:
+        :param user:
+        :param dbname:
+        :param password:
+        :param host:
+        :param port:
+        :param charset:
         :param echo:
         """
         super().__init__(echo=echo)
         try:
-            self._conn = MySQLdb.connect(user=config.get('user'),
-                                        password=config.get('password'),
-                                        database=config.get('dbname'),
-                                        charset='utf8')
+            self._conn = MySQLdb.connect(user=user,
+                                         password=password or '',
+                                         host=host or 'localhost',
+                                         port=port or 3306,
+                                         database=dbname.lstrip('/'),
+                                         charset=charset)
             self._cur = self._conn.cursor()
 
         except MySQLdb.OperationalError as err:
@@ -35,8 +51,99 @@ class MySqlConnection(BaseDatabase):
             sys.exit(1)
         warnings.filterwarnings("ignore", category=MySQLdb.Warning)
 
+    def execute(self, sql, args=()):
+        return self._run(self._cur.execute, sql, args or None)
+
+    def create_index(self, model, index):
+        # MySQL has no CREATE INDEX IF NOT EXISTS
+        self.execute('SELECT 1 FROM information_schema.statistics '
+                     'WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1',
+                     (model.table_name, index.index_name(model.table_name)))
+        if self._cur.fetchone():
+            return None
+        return self.execute(self.index_sql(model.table_name, index, if_not_exists=False))
+
+    def index_sql(self, table_name, index, if_not_exists=True):
+        # partial indexes are not supported, the index covers the whole table
+        columns = ','.join([self.index_column(index, c) for c in index.all_columns()])
+        sql = 'CREATE UNIQUE INDEX' if index.unique else 'CREATE INDEX'
+        if if_not_exists:
+            sql += ' IF NOT EXISTS'
+        return f'{sql} {index.index_name(table_name)} ON {table_name} ({columns})'
+
+    @staticmethod
+    def upsert_clause(conflict, update):
+        # MySQL matches any unique key, the conflict columns are not named
+        if not update:
+            update = conflict[:1]
+        values = ','.join([f'{name} = VALUES({name})' for name in update])
+        return f' ON DUPLICATE KEY UPDATE {values}'
+
+    @staticmethod
+    def index_column(index, column):
+        length = index.prefix_length(column)
+        if length:
+            return f'{column.column_name}({length})'
+        return column.column_name
+
+    def begin(self):
+        # autocommit is off, a transaction is always open and
+        # START TRANSACTION would commit the pending work
+        pass
+
+    def ping(self):
+        try:
+            self._conn.ping()
+        except MySQLdb.Error:
+            return False
+        return True
+
+    def _stream_cursor(self):
+        # the default cursor buffers the whole result on the client
+        return self._conn.cursor(MySQLdb.cursors.SSCursor)
+
+    def _insert_rows(self, query, rows, models):
+        """
+        Send rows as multi-row INSERT ... VALUES (...),(...) statements, split so
+        each statement stays under the placeholder limit and max_packet bytes.
+        Generated ids are consecutive within one statement, so models without
+        a primary key value get lastrowid + offset, except for upserts where
+        updated rows take no new id.
+        """
+        width = max(len(query._names), 1)
+        limit = self.max_placeholders // width
+        head = len(query._base_sql(0))
+        row_sql = len(query._base_sql(1)) - head + 1
+        count = 0
+        start = 0
+        while start < len(rows):
+            end = start
+            size = head
+            while end < len(rows) and end - start < limit:
+                size += row_sql + sum([len(str(v)) for v in rows[end]])
+                if end > start and size > self.max_packet:
+                    break
+                end += 1
+            count += self._insert_chunk(query, rows[start:end], models[start:end])
+            if query.errors:
+                break
+            start = end
+        return count
+
+    def _insert_chunk(self, query, rows, models):
+        args = [value for row in rows for value in row]
+        query.errors = self.execute(query.multirow_sql(len(rows)), args)
+        if query.errors:
+            return 0
+        pk = query.model.__primary_key__
+        if pk is not None and pk.column_name not in query._names and query._conflict is None and self._cur.lastrowid:
+            for offset, model in enumerate(models):
+                setattr(model, pk.column_name, self._cur.lastrowid + offset)
+        return self.rowcount
+
 class MariaConnection(MySqlConnection):
-    pass
+    def create_index(self, model, index):
+        return self.execute(self.index_sql(model.table_name, index))
 
 class MysqlAdmin:
     def create_user(self, username, password=''):
@@ -0,0 +1,191 @@
+# Copyright 2019 AngrySoft Sebastian Zwierzchowski
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from collections import deque
+from functools import lru_cache
+import re
+from .base import BaseDatabase
+from .sqlite import SqliteConnection
+
+_select_list = re.compile(r'^\s*SELECT\s+(?:DISTINCT\s+)?(.*?)(?:\s+FROM\s+.*)?$', re.I | re.S)
+_alias = re.compile(r'\s+AS\s+(\w+)\s*$', re.I)
+
+
+@lru_cache(maxsize=1024)
+def result_columns(sql):
+    """Names of the result columns of a SELECT, as sqlite reports them"""
+    match = _select_list.match(sql)
+    if match is None:
+        return ()
+    items = list()
+    depth = 0
+    start = 0
+    text = match.group(1)
+    for pos, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and not depth:
+            items.append(text[start:pos])
+            start = pos + 1
+    items.append(text[start:])
+    names = list()
+    for item in items:
+        item = item.strip()
+        alias = _alias.search(item)
+        if alias:
+            names.append(alias.group(1))
+        elif '(' in item:
+            names.append(item)
+        else:
+            names.append(item.rsplit('.', 1)[-1])
+    return tuple(names)
+
+
+def synthetic_value(name, index):
+    """Default cell of synthetic rows: ids count from 1, everything else is text"""
+    if name.endswith('id'):
+        return index + 1
+    return f'{name}_{index}'
+
+
+class NullCursor:
+    """DB-API cursor which records statements and answers SELECT with synthetic rows"""
+    arraysize = 1
+
+    def __init__(self, driver):
+        self._driver = driver
+        self._rows = iter(())
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, sql, args=()):
+        driver = self._driver
+        driver.executed += 1
+        if driver.record:
+            driver.statements.append((sql, args))
+        names = result_columns(sql)
+        if names:
+            self.description = tuple([(name, None, None, None, None, None, None) for name in names])
+            self._rows = driver.rows_for(names)
+            self.rowcount = -1
+            return self
+        self.description = None
+        self._rows = iter(())
+        kind = sql.lstrip()[:6].upper()
+        if kind == 'INSERT':
+            driver.last_id += 1
+            self.lastrowid = driver.last_id
+            self.rowcount = 1
+        elif kind in ('UPDATE', 'DELETE'):
+            self.rowcount = driver.rows
+        else:
+            self.rowcount = -1
+        return self
+
+    def executemany(self, sql, seq_of_args):
+        seq_of_args = list(seq_of_args)
+        driver = self._driver
+        driver.executed += 1
+        if driver.record:
+            driver.statements.append((sql, seq_of_args))
+        self.description = None
+        self._rows = iter(())
+        self.rowcount = len(seq_of_args)
+        if sql.lstrip()[:6].upper() == 'INSERT':
+            driver.last_id += len(seq_of_args)
+            self.lastrowid = driver.last_id
+        return self
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size=None):
+        rows = list()
+        for row in self._rows:
+            rows.append(row)
+            if len(rows) >= (size or self.arraysize):
+                break
+        return rows
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        self._rows = iter(())
+
+
+class NullDriver:
+    """
+    In process stand in for a DB-API connection. Every SELECT returns `rows`
+    synthetic rows built by value(column name, row index), other statements
+    are only recorded. The most recent `record` statements are kept in
+    statements.
+    """
+
+    def __init__(self, rows=100, value=synthetic_value, record=1000):
+        self.rows = rows
+        self.value = value
+        self.record = record
+        self.statements = deque(maxlen=record)
+        self.executed = 0
+        self.commits = 0
+        self.last_id = 0
+        self.in_transaction = False
+        self._cache = dict()
+
+    def rows_for(self, names):
+        # rows are built once per result shape, fetching them costs no more than a real driver
+        key = (names, self.rows, self.value)
+        rows = self._cache.get(key)
+        if rows is None:
+            rows = [tuple([self.value(name, i) for name in names]) for i in range(self.rows)]
+            self._cache = {key: rows}
+        return iter(rows)
+
+    def cursor(self, *args):
+        return NullCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullConnection(SqliteConnection):
+    """
+    Connection without a database, for profiling angrySQL itself. Statements
+    are rendered in the sqlite dialect, recorded in driver.statements and never
+    run, queries return driver.rows synthetic rows.
+
+        db = Connection('null://?rows=1000')
+        db.select(Users).all()
+    """
+
+    def __init__(self, rows=100, value=synthetic_value, record=1000, echo=False):
+        BaseDatabase.__init__(self, echo=echo)
+        self.driver = self._conn = NullDriver(rows=rows, value=value, record=record)
+        self._cur = self._conn.cursor()
+
+    # nothing is stored, so there are no generated keys to read back
+    _insert_rows = BaseDatabase._insert_rows
+
+    @property
+    def statements(self):
+        return self.driver.statements
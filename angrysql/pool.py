@@ -0,0 +1,187 @@
+# Copyright 2019 AngrySoft Sebastian Zwierzchowski
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from contextlib import contextmanager
+from threading import Condition
+from time import monotonic
+
+
+class PoolTimeout(TimeoutError):
+    pass
+
+
+class _PoolEntry:
+    __slots__ = ('db', 'created', 'uses')
+
+    def __init__(self, db):
+        self.db = db
+        self.created = monotonic()
+        self.uses = 0
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of database connections.
+
+    pool_size connections are kept open between checkouts, up to max_overflow
+    more are opened under load and closed again when returned.
+
+        pool = Connection('sqlite://app.db', pool_size=8, max_overflow=4)
+        with pool.connection() as db:
+            users = db.select(Users).all()
+    """
+
+    def __init__(self, creator, pool_size=5, max_overflow=0, timeout=30.0,
+                 recycle=None, max_uses=None, pre_ping=True):
+        """
+        :param creator: callable returning a new BaseDatabase connection
+        :param pool_size: number of idle connections kept open
+        :param max_overflow: connections allowed above pool_size
+        :param timeout: seconds to wait for a free connection
+        :param recycle: reopen connections older than this many seconds
+        :param max_uses: reopen connections after this many checkouts
+        :param pre_ping: check a connection is alive before handing it out
+        """
+        self._creator = creator
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.max_uses = max_uses
+        self.pre_ping = pre_ping
+
+        self._cond = Condition()
+        self._idle = list()
+        self._in_use = dict()
+        self._opened = 0
+        self._stats = {'checkouts': 0,
+                       'created': 0,
+                       'recycled': 0,
+                       'invalidated': 0,
+                       'timeouts': 0,
+                       'wait_time': 0.0}
+
+    @contextmanager
+    def connection(self, timeout=None):
+        db = self.checkout(timeout)
+        try:
+            yield db
+        finally:
+            self.checkin(db)
+
+    def checkout(self, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        start = monotonic()
+        deadline = start + timeout
+        entry = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._opened < self.pool_size + self.max_overflow:
+                    self._opened += 1
+                    break
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'no connection available after {timeout}s')
+                self._cond.wait(remaining)
+            self._stats['checkouts'] += 1
+            self._stats['wait_time'] += monotonic() - start
+
+        try:
+            if entry is None:
+                entry = self._open()
+            elif self._expired(entry):
+                self._stats['recycled'] += 1
+                entry = self._reopen(entry)
+            elif self.pre_ping and not entry.db.ping():
+                self._stats['invalidated'] += 1
+                entry = self._reopen(entry)
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+        entry.uses += 1
+        with self._cond:
+            self._in_use[id(entry.db)] = entry
+        return entry.db
+
+    def checkin(self, db):
+        with self._cond:
+            entry = self._in_use.pop(id(db))
+        try:
+            db.rollback()
+        except Exception:
+            self._discard(entry)
+            return
+        with self._cond:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(entry)
+                self._cond.notify()
+                return
+        self._discard(entry)
+
+    def dispose(self):
+        """Close all idle connections"""
+        with self._cond:
+            idle, self._idle = self._idle, list()
+        for entry in idle:
+            self._discard(entry)
+
+    def stats(self):
+        with self._cond:
+            ret = dict(self._stats)
+            ret.update({'pool_size': self.pool_size,
+                        'max_overflow': self.max_overflow,
+                        'opened': self._opened,
+                        'idle': len(self._idle),
+                        'checked_out': len(self._in_use),
+                        'overflow': max(self._opened - self.pool_size, 0)})
+        return ret
+
+    def _open(self):
+        entry = _PoolEntry(self._creator())
+        with self._cond:
+            self._stats['created'] += 1
+        return entry
+
+    def _reopen(self, entry):
+        try:
+            entry.db.close()
+        except Exception:
+            pass
+        return self._open()
+
+    def _discard(self, entry):
+        try:
+            entry.db.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._opened -= 1
+            self._cond.notify()
+
+    def _expired(self, entry):
+        if self.recycle is not None and monotonic() - entry.created > self.recycle:
+            return True
+        if self.max_uses is not None and entry.uses >= self.max_uses:
+            return True
+        return False
+
+    def __len__(self):
+        return self._opened
@@ -13,12 +13,322 @@
 # limitations under the License.
 
 
+class _Unset:
+    """Value of a compact model field which was never assigned"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'UNSET'
+
+    def __bool__(self):
+        return False
+
+
+UNSET = _Unset()
+
+
+class Expression:
+    """Sql fragment which keeps its values apart from the sql text.
+
+    Values are rendered as driver placeholders and collected in order,
+    so the same query shape always produces the same sql string.
+    """
+
+    def compile(self, placeholder='?'):
+        args = list()
+        sql = self._compile(placeholder, args)
+        return sql, tuple(args)
+
+    def _compile(self, placeholder, args):
+        raise NotImplementedError
+
+    def shape(self):
+        """Hashable structure of the expression with the values left out"""
+        raise NotImplementedError
+
+    def _collect(self, args):
+        """Append bound values in the order _compile would emit them"""
+        raise NotImplementedError
+
+    @property
+    def params(self):
+        return self.compile()[1]
+
+    def __and__(self, other):
+        return and_(self, other)
+
+    def __or__(self, other):
+        return or_(self, other)
+
+    def __str__(self):
+        return self.compile()[0]
+
+
+def _operand(value, placeholder, args):
+    if isinstance(value, Column):
+        return value.column_full_name
+    if isinstance(value, Expression):
+        return value._compile(placeholder, args)
+    args.append(value)
+    return placeholder
+
+
+def _operand_shape(value):
+    if isinstance(value, Column):
+        return value.column_full_name
+    if isinstance(value, Expression):
+        return value.shape()
+    return None
+
+
+def _operand_collect(value, args):
+    if isinstance(value, Expression):
+        value._collect(args)
+    elif not isinstance(value, Column):
+        args.append(value)
+
+
+class Text(Expression):
+    """Raw sql with optional arguments, used for plain string conditions"""
+
+    def __init__(self, sql, args=()):
+        self.sql = sql
+        self.args = tuple(args)
+
+    def _compile(self, placeholder, args):
+        args.extend(self.args)
+        return self.sql
+
+    def shape(self):
+        return ('text', self.sql, len(self.args))
+
+    def _collect(self, args):
+        args.extend(self.args)
+
+
+class BinaryExpression(Expression):
+    def __init__(self, left, operator, right):
+        if right is None and operator in ('=', '!='):
+            operator = 'IS' if operator == '=' else 'IS NOT'
+            right = Text('NULL')
+        self.left = left
+        self.operator = operator
+        self.right = right
+
+    def _compile(self, placeholder, args):
+        left = _operand(self.left, placeholder, args)
+        right = _operand(self.right, placeholder, args)
+        return f'{left} {self.operator} {right}'
+
+    def shape(self):
+        return ('op', _operand_shape(self.left), self.operator, _operand_shape(self.right))
+
+    def _collect(self, args):
+        _operand_collect(self.left, args)
+        _operand_collect(self.right, args)
+
+
+class Between(Expression):
+    def __init__(self, column, low, high):
+        self.column = column
+        self.low = low
+        self.high = high
+
+    def _compile(self, placeholder, args):
+        column = _operand(self.column, placeholder, args)
+        low = _operand(self.low, placeholder, args)
+        high = _operand(self.high, placeholder, args)
+        return f'{column} BETWEEN {low} AND {high}'
+
+    def shape(self):
+        return ('between', _operand_shape(self.column), _operand_shape(self.low), _operand_shape(self.high))
+
+    def _collect(self, args):
+        _operand_collect(self.column, args)
+        _operand_collect(self.low, args)
+        _operand_collect(self.high, args)
+
+
+class InList(Expression):
+    def __init__(self, column, values, negate=False):
+        self.column = column
+        self.values = tuple(values)
+        self.negate = negate
+
+    def _compile(self, placeholder, args):
+        if not self.values:
+            # empty IN () is not valid in every dialect
+            return '1 = 1' if self.negate else '1 = 0'
+        column = _operand(self.column, placeholder, args)
+        values = ', '.join([_operand(v, placeholder, args) for v in self.values])
+        operator = 'NOT IN' if self.negate else 'IN'
+        return f'{column} {operator} ({values})'
+
+    def shape(self):
+        # the number of placeholders is part of the sql text
+        return ('in', _operand_shape(self.column), self.negate, tuple(_operand_shape(v) for v in self.values))
+
+    def _collect(self, args):
+        if self.values:
+            _operand_collect(self.column, args)
+            for v in self.values:
+                _operand_collect(v, args)
+
+
+class ClauseList(Expression):
+    def __init__(self, operator, clauses):
+        self.operator = operator
+        self.clauses = tuple(as_expression(c) for c in clauses)
+
+    def _compile(self, placeholder, args):
+        sql = f' {self.operator} '.join([c._compile(placeholder, args) for c in self.clauses])
+        if len(self.clauses) > 1:
+            sql = f'({sql})'
+        return sql
+
+    def shape(self):
+        return (self.operator, tuple(c.shape() for c in self.clauses))
+
+    def _collect(self, args):
+        for c in self.clauses:
+            c._collect(args)
+
+
+class RowComparison(Expression):
+    """(a, b) > (?, ?) comparison of several columns at once"""
+
+    def __init__(self, columns, operator, values):
+        self.columns = tuple(columns)
+        self.operator = operator
+        self.values = tuple(values)
+
+    def _compile(self, placeholder, args):
+        columns = ', '.join([_operand(c, placeholder, args) for c in self.columns])
+        values = ', '.join([_operand(v, placeholder, args) for v in self.values])
+        return f'({columns}) {self.operator} ({values})'
+
+    def shape(self):
+        return ('row', tuple(_operand_shape(c) for c in self.columns), self.operator,
+                tuple(_operand_shape(v) for v in self.values))
+
+    def _collect(self, args):
+        for c in self.columns:
+            _operand_collect(c, args)
+        for v in self.values:
+            _operand_collect(v, args)
+
+
+class Function(Expression):
+    """
+    Sql function call such as COUNT(users.user_id), usable as a selected
+    column and compared like a column in having():
+
+        db.select(WorkDays).columns(WorkDays.user_id, WorkDays.day.count()) \\
+            .group_by(WorkDays.user_id).having(WorkDays.day.count() > 2).tuples()
+    """
+
+    def __init__(self, name, *arguments, distinct=False):
+        self.name = name
+        self.arguments = arguments
+        self.distinct = distinct
+
+    def _compile(self, placeholder, args):
+        arguments = ', '.join([_operand(a, placeholder, args) for a in self.arguments])
+        if self.distinct:
+            arguments = 'DISTINCT ' + arguments
+        return f'{self.name}({arguments})'
+
+    def shape(self):
+        return ('fn', self.name, self.distinct, tuple(_operand_shape(a) for a in self.arguments))
+
+    def _collect(self, args):
+        for a in self.arguments:
+            _operand_collect(a, args)
+
+    def label(self, name):
+        """Name the result column, as seen by dicts()"""
+        return Label(self, name)
+
+    def __eq__(self, other):
+        return BinaryExpression(self, '=', other)
+
+    def __ne__(self, other):
+        return BinaryExpression(self, '!=', other)
+
+    def __lt__(self, other):
+        return BinaryExpression(self, '<', other)
+
+    def __le__(self, other):
+        return BinaryExpression(self, '<=', other)
+
+    def __gt__(self, other):
+        return BinaryExpression(self, '>', other)
+
+    def __ge__(self, other):
+        return BinaryExpression(self, '>=', other)
+
+    __hash__ = object.__hash__
+
+
+class Label(Expression):
+    """expression AS name in a select list"""
+
+    def __init__(self, expression, name):
+        self.expression = expression
+        self.name = name
+
+    def _compile(self, placeholder, args):
+        return f'{_operand(self.expression, placeholder, args)} AS {self.name}'
+
+    def shape(self):
+        return ('as', _operand_shape(self.expression), self.name)
+
+    def _collect(self, args):
+        _operand_collect(self.expression, args)
+
+
+def count(column=None, distinct=False):
+    """COUNT(column), or COUNT(*) without a column"""
+    if column is None:
+        return Function('COUNT', Text('*'))
+    return Function('COUNT', column, distinct=distinct)
+
+
+def sql_literal(value):
+    """Value written into sql text, for statements which can not bind arguments"""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def inline_sql(condition):
+    """Compile a condition with its values written as literals"""
+    sql, args = as_expression(condition).compile('\x00')
+    parts = sql.split('\x00')
+    ret = parts[0]
+    for value, part in zip(args, parts[1:]):
+        ret += sql_literal(value) + part
+    return ret
+
+
+def as_expression(condition):
+    if isinstance(condition, Expression):
+        return condition
+    if isinstance(condition, str):
+        return Text(condition)
+    raise ValueError(f'{condition!r} is not a sql condition')
+
+
 def or_(*args):
-    return ' OR '.join(args)
+    return ClauseList('OR', args)
 
 
 def and_(*args):
-    return ' AND '.join(args)
+    return ClauseList('AND', args)
 
 
 class ColumnType:
@@ -95,12 +405,14 @@ class TimeStamp(ColumnType):
 class Column:
 
     def __init__(self, column_type, nullable=True, unique=False, default=None,
-                 primary_key=False, foreignkey=None, cascade=None, unsigned=False, ):
+                 primary_key=False, foreignkey=None, cascade=None, unsigned=False, index=False):
         self.column_type = column_type
         self.nullable = nullable
         self.unique = unique
+        self.index = index
         self.column_name = ''
         self.column_full_name = ''
+        self.model = None
         self.default = default
         self.primary_key = primary_key
         self.foreignkey = foreignkey
@@ -117,50 +429,95 @@ class Column:
         self._value = _value
 
     def like(self, other):
-        return f"{self.column_full_name} LIKE '{other}'"
-    
-    def between(self, val1 , val2):
-        return f"{self.column_full_name} BETWEEN '{val1}' AND '{val2}'"
+        return BinaryExpression(self, 'LIKE', other)
+
+    def between(self, val1, val2):
+        return Between(self, val1, val2)
 
     def in_(self, *args):
-        values = ', '.join([f"'{a}'" for a in args])
-        return f'{self.column_full_name} IN ({values})'
+        return InList(self, args)
 
     def not_in(self, *args):
-        values = ', '.join([f"'{a}'" for a in args])
-        return f'{self.column_full_name} NOT IN ({values})'
+        return InList(self, args, negate=True)
+
+    def count(self, distinct=False):
+        return count(self, distinct=distinct)
+
+    def sum(self):
+        return Function('SUM', self)
+
+    def avg(self):
+        return Function('AVG', self)
+
+    def min(self):
+        return Function('MIN', self)
+
+    def max(self):
+        return Function('MAX', self)
 
     def __eq__(self, other):
-        if isinstance(other, self.__class__):
-            other = other.column_full_name
-        return f"{self.column_full_name} = '{other}'"
+        return BinaryExpression(self, '=', other)
 
     def __ne__(self, other):
-        if isinstance(other, self.__class__):
-            other = other.column_full_name
-        return f"{self.column_full_name} != '{other}'"
+        return BinaryExpression(self, '!=', other)
 
     def __lt__(self, other):
-        if isinstance(other, self.__class__):
-            other = other.column_full_name
-        return f"{self.column_full_name} < '{other}'"
-    
+        return BinaryExpression(self, '<', other)
+
     def __le__(self, other):
-        if isinstance(other, self.__class__):
-            other = other.column_full_name
-        return f"{self.column_full_name} <= '{other}'"
-    
+        return BinaryExpression(self, '<=', other)
+
     def __gt__(self, other):
-        if isinstance(other, self.__class__):
-            other = other.column_full_name
-        return f"{self.column_full_name} > '{other}'"
+        return BinaryExpression(self, '>', other)
 
     def __ge__(self, other):
-        if isinstance(other, self.__class__):
-            other = other.column_full_name
-        return f"{self.column_full_name} >= '{other}'"
+        return BinaryExpression(self, '>=', other)
+
+    __hash__ = object.__hash__
 
     def __str__(self):
         return self.column_full_name
 
 
+class Index:
+    """
+    Secondary index declared in a model's __indexes__ list.
+
+        class WorkDays(BaseModel):
+            ...
+            __indexes__ = [Index(user_id, year, month),
+                           Index(login, prefix={login: 16}),
+                           Index(user_id, where=end != None, include=[start])]
+
+    :param columns: indexed columns, in order
+    :param name: index name, generated from table and columns when not given
+    :param unique: create a unique index
+    :param where: condition of a partial index (sqlite), ignored by MySQL
+    :param include: extra columns appended to make the index covering
+    :param prefix: {column: length} prefix lengths (MySQL), ignored by sqlite
+    """
+
+    def __init__(self, *columns, name=None, unique=False, where=None, include=(), prefix=None):
+        if not columns:
+            raise ValueError('Index needs at least one column')
+        self.columns = list(columns)
+        self.name = name
+        self.unique = unique
+        self.where = where
+        self.include = list(include)
+        self.prefix = prefix or dict()
+
+    def all_columns(self):
+        # Column == builds an expression, compare by identity
+        return self.columns + [c for c in self.include if not any(c is i for i in self.columns)]
+
+    def index_name(self, table_name):
+        if self.name:
+            return self.name
+        kind = 'ux' if self.unique else 'ix'
+        return '_'.join([kind, table_name] + [c.column_name for c in self.columns])
+
+    def prefix_length(self, column):
+        for col, length in self.prefix.items():
+            if col is column:
+                return length
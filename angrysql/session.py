@@ -0,0 +1,112 @@
+# Copyright 2019 AngrySoft Sebastian Zwierzchowski
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from .schema import Column, UNSET
+
+
+class Session:
+    """
+    Unit of work: models added to the session are written by flush().
+    New models are inserted, loaded ones only send the columns changed since
+    they were loaded, and updates of the same model and columns go out as one
+    executemany batch.
+
+        with db.transaction(), db.session() as session:
+            for user in db.select(Users).all():
+                user.email = user.email.lower()
+                session.add(user)
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._models = dict()
+
+    def add(self, model):
+        self._models[id(model)] = model
+        return model
+
+    def add_all(self, models):
+        for model in models:
+            self.add(model)
+
+    def clear(self):
+        """Stop tracking all models"""
+        self._models.clear()
+
+    def dirty(self):
+        """Tracked models with changes which flush would write"""
+        return [m for m in self._models.values() if m._changes()]
+
+    def flush(self):
+        """
+        Write pending changes of all tracked models, they stay tracked.
+        :return: number of rows written
+        """
+        new = list()
+        updates = dict()
+        for model in self._models.values():
+            if getattr(model, '_loaded', None) is None:
+                new.append(model)
+                continue
+            changes = model._changes()
+            if changes:
+                names = tuple([c.column_name for c, val in changes])
+                updates.setdefault((type(model), names), list()).append((model, changes))
+
+        written = 0
+        if new:
+            # models of failed batches stay dirty, the next flush tries them again
+            inserted = list()
+            written += self.db._insert_queries(map(self.db.insert, new), 1000, written=inserted)
+            for model in inserted:
+                model._mark_clean()
+        for (model_class, names), batch in updates.items():
+            written += self._update(model_class, names, batch)
+        return written
+
+    def _update(self, model_class, names, batch):
+        pk = model_class.__primary_key__
+        if pk is None:
+            raise ValueError(f'{model_class.__name__} has no primary key')
+        db = self.db
+        key = ('flush', names, type(db))
+        sql = model_class.__statements__.get(key)
+        if sql is None:
+            values = ','.join([f'{name} = {db.placeholder}' for name in names])
+            sql = f'UPDATE {model_class.table_name} SET {values} WHERE {pk.column_name} = {db.placeholder}'
+            model_class.__statements__.put(key, sql)
+
+        rows = list()
+        for model, changes in batch:
+            # the row is found by the key it was loaded with, even when the key changed
+            model_id = dict(zip(*model._loaded)).get(pk.column_name, getattr(model, pk.column_name))
+            if model_id is None or model_id is UNSET or isinstance(model_id, Column):
+                raise ValueError(f'{model_class.__name__} instance without a primary key value')
+            rows.append(tuple([val for c, val in changes]) + (model_id,))
+        errors = db.executemany(sql, rows)
+        db._invalidate(model_class.table_name)
+        if errors:
+            return 0
+        for model, changes in batch:
+            model._mark_clean()
+        return len(rows)
+
+    def __len__(self):
+        return len(self._models)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
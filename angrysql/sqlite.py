@@ -13,24 +13,165 @@
 # limitations under the License.
 import sys
 import sqlite3
-from .base import BaseDatabase
+from .base import BaseDatabase, log
+from .schema import BinaryExpression, RowComparison
+
+
+def _choice(*values):
+    def check(value):
+        value = str(value).upper()
+        if value not in values:
+            raise ValueError(f"expected one of {', '.join(values)}")
+        return value
+    return check
+
+
+def _integer(minimum=None):
+    def check(value):
+        value = int(value)
+        if minimum is not None and value < minimum:
+            raise ValueError(f'expected at least {minimum}')
+        return value
+    return check
+
+
+# applied in this order, busy_timeout first so switching the journal mode waits for other connections
+PRAGMAS = {'busy_timeout': _integer(0),
+           'journal_mode': _choice('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'),
+           'synchronous': _choice('OFF', 'NORMAL', 'FULL', 'EXTRA', '0', '1', '2', '3'),
+           'cache_size': _integer(),
+           'mmap_size': _integer(0),
+           'temp_store': _choice('DEFAULT', 'FILE', 'MEMORY', '0', '1', '2'),
+           'foreign_keys': _choice('ON', 'OFF', '1', '0', 'TRUE', 'FALSE', 'YES', 'NO')}
+
+PRESETS = {
+    # WAL lets readers run next to the writer, NORMAL sync is safe with WAL
+    # (a power loss may drop the last commits, never corrupts), 64 MiB page
+    # cache and 256 MiB of memory mapped reads.
+    'production': {'journal_mode': 'WAL',
+                   'synchronous': 'NORMAL',
+                   'cache_size': -65536,
+                   'mmap_size': 268435456,
+                   'busy_timeout': 5000,
+                   'temp_store': 'MEMORY'},
+}
+
+
+def sqlite_pragmas(params):
+    """
+    Validate pragma settings, for example the query string of a sqlite url.
+    preset names an entry of PRESETS, the other keys override its values.
+    :return: {pragma: value} in the order they should be applied
+    """
+    params = dict(params)
+    settings = {'foreign_keys': 'ON'}
+    preset = params.pop('preset', None)
+    if preset is not None:
+        if preset not in PRESETS:
+            raise ValueError(f'unknown sqlite preset {preset}')
+        settings.update(PRESETS[preset])
+    settings.update(params)
+    pragmas = dict()
+    for name in PRAGMAS:
+        if name in settings:
+            try:
+                pragmas[name] = PRAGMAS[name](settings.pop(name))
+            except ValueError as err:
+                raise ValueError(f'invalid sqlite {name}: {err}') from None
+    if settings:
+        raise ValueError(f"unknown sqlite parameter {', '.join(sorted(settings))}")
+    return pragmas
 
 
 class SqliteConnection(BaseDatabase):
-    def __init__(self, dbfile=':memory:', echo=False):
+    driver_errors = (sqlite3.Error,)
+    # SQLITE_MAX_VARIABLE_NUMBER default
+    max_placeholders = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+    explain_prefix = 'EXPLAIN QUERY PLAN'
+
+    def __init__(self, dbfile=':memory:', echo=False, check_same_thread=True, pragmas=None):
+        """
+        :param dbfile: path of the database file or :memory:
+        :param echo:
+        :param check_same_thread: refuse use from other threads than the opening one
+        :param pragmas: {pragma: value}, see PRAGMAS and PRESETS
+        """
         super().__init__(echo=echo)
-        
-        self.echo = echo
+        self.pragmas = sqlite_pragmas(pragmas or {})
         try:
-            self._conn = sqlite3.connect(dbfile)
+            self._conn = sqlite3.connect(dbfile, check_same_thread=check_same_thread)
             self._cur = self._conn.cursor()
-            self._cur.execute('PRAGMA foreign_keys = ON')
+            for name, value in self.pragmas.items():
+                self._cur.execute(f'PRAGMA {name} = {value}')
+            if 'journal_mode' in self.pragmas:
+                mode = self._cur.execute('PRAGMA journal_mode').fetchone()[0].upper()
+                if mode != self.pragmas['journal_mode']:
+                    # :memory: databases stay in MEMORY mode
+                    log.warning('sqlite journal_mode is %s instead of %s', mode, self.pragmas['journal_mode'])
 
         except sqlite3.OperationalError as err:
             sys.stderr.write('Connection Error: {}\n'.format(err))
             sys.exit(1)
         # warnings.filterwarnings("ignore", category=sqlite3.Warning)
     
+    def begin(self):
+        # the driver may already have opened one before a dml statement
+        if not self._conn.in_transaction:
+            self.execute('BEGIN')
+
+    def _insert_rows(self, query, rows, models):
+        """
+        Rows which need no generated key go out through executemany. Models
+        without a primary key value get the generated one: on sqlite >= 3.35
+        the rows are sent as multi-row INSERT ... RETURNING, on older versions
+        one at a time reading lastrowid.
+        """
+        pk = query.model.__primary_key__
+        if pk is None or pk.column_name in query._names or query._conflict is not None:
+            return super()._insert_rows(query, rows, models)
+        if sqlite3.sqlite_version_info < (3, 35, 0):
+            sql = query.compile()[0]
+            for count, (row, model) in enumerate(zip(rows, models)):
+                query.errors = self.execute(sql, row)
+                if query.errors:
+                    return count
+                setattr(model, pk.column_name, self._cur.lastrowid)
+            return len(rows)
+
+        step = max(self.max_placeholders // max(len(query._names), 1), 1)
+        count = 0
+        for start in range(0, len(rows), step):
+            chunk = rows[start:start + step]
+            sql = f'{query.multirow_sql(len(chunk))} RETURNING {pk.column_name}'
+            query.errors = self._run(self._execute_returning, sql, [value for row in chunk for value in row])
+            if query.errors:
+                return count
+            # RETURNING rows come in no set order, new rowids grow in insert order
+            keys = sorted([row[0] for row in self._returned])
+            for model, key in zip(models[start:start + step], keys):
+                setattr(model, pk.column_name, key)
+            count += len(keys)
+        return count
+
+    def _execute_returning(self, sql, args):
+        # sqlite counts the rows of a RETURNING statement while they are fetched,
+        # fetching inside _run lets the after_execute hook see the final rowcount
+        self._returned = self._cur.execute(sql, args).fetchall()
+
+    @staticmethod
+    def limit_clause(limit, offset, placeholder):
+        sql = f'LIMIT {placeholder}' if limit is not None else 'LIMIT -1'
+        if offset is not None:
+            sql += f' OFFSET {placeholder}'
+        return sql
+
+    @staticmethod
+    def seek_condition(columns, values, desc=False):
+        # row values (sqlite >= 3.15) are matched to a multi-column index directly
+        if len(columns) == 1:
+            return BinaryExpression(columns[0], '<' if desc else '>', values[0])
+        return RowComparison(columns, '<' if desc else '>', values)
+
     @property
     def primary_key(self):
         return 'PRIMARY KEY'
@@ -42,26 +183,3 @@ class SqliteConnection(BaseDatabase):
     @staticmethod
     def foreignkey(column_name, table_name, owner_column, column_full_name):
         return f"FOREIGN KEY({column_name}) REFERENCES {table_name}({owner_column})"
-    
-    def execute(self, sql, args=()):
-        errors = None
-        try:
-            if self.echo:
-                print(sql, args)
-            self._cur.execute(sql, args)
-
-        except sqlite3.IntegrityError as err:
-            print('Integrity', err)
-            errors = err
-        except sqlite3.OperationalError as err:
-            print('Operational', err)
-            errors = err
-        except sqlite3.ProgrammingError as err:
-            print('Programing', err)
-            errors = err
-        except Exception as err:
-            print(f'something goes wrong: {err}')
-        finally:
-            return errors
-
-    
\ No newline at end of file
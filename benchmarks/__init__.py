@@ -0,0 +1 @@
+"""Performance benchmarks of angrySQL, run with python -m benchmarks"""
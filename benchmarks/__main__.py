@@ -0,0 +1,45 @@
+import argparse
+import json
+import sys
+from .suite import BACKENDS, SIZES, compare, run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='angrySQL benchmarks')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help='comma separated row counts')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='comma separated backends')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each case, the best one counts')
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--baseline', help='compare with the results stored in this json file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown, 0.1 is 10%%')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline) as fd:
+                baseline = json.load(fd)
+        except FileNotFoundError:
+            print(f'baseline {args.baseline} not found, store one with make bench-baseline first', file=sys.stderr)
+            return 2
+
+    report = run(sizes=[int(s) for s in args.sizes.split(',')],
+                 backends=args.backends.split(','),
+                 repeat=args.repeat)
+    for key, result in sorted(report['results'].items()):
+        print(f"{key:<32} {result['value']:>14.6g} {result['unit']}")
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        for key, previous, current, ratio in regressions:
+            print(f'REGRESSION {key}: {previous:.6g} -> {current:.6g} ({ratio:.2f}x)', file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
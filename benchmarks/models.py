@@ -0,0 +1,24 @@
+from angrysql import BaseModel, Column, Integer, String, TimeStamp
+
+
+class Author(BaseModel):
+    author_id = Column(Integer(), primary_key=True)
+    login = Column(String(64), unique=True, nullable=False)
+    email = Column(String(255))
+    score = Column(Integer(), default='0')
+
+
+class Post(BaseModel):
+    post_id = Column(Integer(), primary_key=True)
+    author_id = Column(Integer(), nullable=False, foreignkey='author.author_id', index=True)
+    title = Column(String(255), nullable=False)
+    body = Column(String())
+    created = Column(TimeStamp())
+
+
+def author(i):
+    return Author(login=f'author_{i}', email=f'author_{i}@example.com', score=i % 100)
+
+
+def post(i, authors):
+    return Post(author_id=i % authors + 1, title=f'post {i}', body='lorem ipsum ' * 8, created=1600000000 + i)
@@ -0,0 +1,164 @@
+import os
+import platform
+import random
+import sqlite3
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from angrysql import Connection
+from .models import Author, Post, author, post
+
+BACKENDS = ('memory', 'file', 'null')
+SIZES = (100, 1000, 10000)
+
+
+def timed(func, repeat, setup=None):
+    """Best wall time of repeat calls of func, setup runs before each call outside the timing"""
+    best = None
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        func()
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@contextmanager
+def database(backend, size):
+    if backend == 'null':
+        # no database at all, only the cost of angrysql itself
+        db = Connection(f'null://?rows={size}&record=0')
+        yield db
+        db.close()
+    elif backend == 'memory':
+        db = Connection('sqlite://:memory:')
+        yield db
+        db.close()
+    elif backend == 'file':
+        with TemporaryDirectory() as tmp:
+            db = Connection(f"sqlite://{os.path.join(tmp, 'bench.db')}")
+            yield db
+            db.close()
+    else:
+        raise ValueError(f'unknown backend {backend}')
+
+
+def reset(db, authors=10):
+    """Empty tables with authors rows in the author table"""
+    db.execute('DROP TABLE IF EXISTS post')
+    db.execute('DROP TABLE IF EXISTS author')
+    db.create_tables(Author, Post)
+    db.insert_many([author(i) for i in range(authors)])
+    db.commit()
+
+
+def fill(db, size):
+    authors = max(size // 10, 1)
+    reset(db, authors)
+    db.insert_many([post(i, authors) for i in range(size)])
+    db.commit()
+
+
+def bench_size(backend, size, repeat):
+    """Run every case against a fresh database of size posts"""
+    results = dict()
+
+    def put(name, value, unit, better):
+        results[f'{backend}/{size}/{name}'] = {'value': value, 'unit': unit, 'better': better}
+
+    with database(backend, size) as db:
+        reset(db)
+
+        def build():
+            for i in range(size):
+                db.select(Post).where(Post.author_id == i, Post.created > i).order_by(Post.created).compile()
+                db.insert(post(i, 10)).compile()
+
+        put('build', timed(build, repeat) / (2 * size), 's/statement', 'lower')
+
+        def insert_single():
+            for i in range(size):
+                db.insert(post(i, 10)).do()
+            db.commit()
+
+        put('insert_single', size / timed(insert_single, repeat, setup=lambda: reset(db)), 'rows/s', 'higher')
+
+        def insert_bulk():
+            db.insert_many([post(i, 10) for i in range(size)])
+            db.commit()
+
+        put('insert_bulk', size / timed(insert_bulk, repeat, setup=lambda: reset(db)), 'rows/s', 'higher')
+
+        fill(db, size)
+        put('select_all', timed(lambda: db.select(Post).all(), repeat), 's', 'lower')
+
+        keys = [random.Random(i).randint(1, size) for i in range(min(size, 1000))]
+
+        def get():
+            for key in keys:
+                db.select(Post).get(key)
+
+        put('get', timed(get, repeat) / len(keys), 's', 'lower')
+
+        db.execute(*db.select(Post).compile())
+        description = db._cur.description
+        rows = db.fetch_tuples()
+
+        def hydrate():
+            list(map(db._hydrator(Post, description), rows))
+
+        put('hydrate', size / timed(hydrate, repeat), 'rows/s', 'higher')
+
+        def join_all():
+            db.join(Post.post_id, Post.title, Author.login).inner(Author, Author.author_id == Post.author_id).all()
+
+        put('join_all', timed(join_all, repeat), 's', 'lower')
+        put('peak_memory', peak_memory(lambda: db.select(Post).all()), 'bytes', 'lower')
+    return results
+
+
+def run(sizes=SIZES, backends=BACKENDS, repeat=3):
+    """Run the suite and return a json serializable report"""
+    results = dict()
+    for backend in backends:
+        for size in sizes:
+            results.update(bench_size(backend, size, repeat))
+    return {'meta': {'python': platform.python_version(),
+                     'sqlite': sqlite3.sqlite_version,
+                     'platform': platform.platform(),
+                     'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                     'repeat': repeat},
+            'results': results}
+
+
+def compare(report, baseline, tolerance=0.1):
+    """
+    List regressions of report against baseline, cases only present in one of
+    them are skipped. A lower-is-better value regresses when it grows by more
+    than tolerance, a higher-is-better one when it shrinks by more than tolerance.
+    """
+    regressions = list()
+    for key, current in sorted(report['results'].items()):
+        previous = baseline['results'].get(key)
+        if previous is None or not previous['value']:
+            continue
+        ratio = current['value'] / previous['value']
+        if current['better'] == 'lower' and ratio > 1 + tolerance:
+            regressions.append((key, previous['value'], current['value'], ratio))
+        elif current['better'] == 'higher' and ratio < 1 / (1 + tolerance):
+            regressions.append((key, previous['value'], current['value'], ratio))
+    return regressions
@@ -1,4 +1,4 @@
-from angrysql import BaseModel
+from angrysql import BaseModel, Index
 from angrysql import Column, Integer, String, SmallInteger, TinyInteger, Year, TimeStamp
 
 class Users(BaseModel):
@@ -10,8 +10,8 @@ class Users(BaseModel):
 
 class UserRates(BaseModel):
     rate_id = Column(Integer(), primary_key=True)
-    user_id = Column(Integer(), nullable=False, foreignkey='users.user_id')
-    rate_name_id = Column(Integer(), nullable=False, foreignkey='rate_name.rate_name_id')
+    user_id = Column(Integer(), nullable=False, foreignkey='users.user_id', index=True)
+    rate_name_id = Column(Integer(), nullable=False, foreignkey='rate_name.rate_name_id', index=True)
     value = Column(SmallInteger(), default='0')
 
 
@@ -36,4 +36,12 @@ class WorkDays(BaseModel):
     year = Column(Year(), nullable=False)
     start = Column(TimeStamp(), nullable=False)
     end = Column(TimeStamp(), nullable=False)
-    user_rate_id = Column(Integer(), foreignkey='user_rates.rate_id')
\ No newline at end of file
+    user_rate_id = Column(Integer(), foreignkey='user_rates.rate_id')
+    __indexes__ = [Index(user_id, year, month, include=[day])]
+
+
+class Tags(BaseModel, compact=True):
+    tag_id = Column(Integer(), primary_key=True)
+    name = Column(String(64), unique=True, nullable=False)
+    description = Column(String())
+    __indexes__ = [Index(description, where=description != None, prefix={description: 32})]
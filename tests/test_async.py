@@ -0,0 +1,68 @@
+#!/usr/bin/python
+
+from angrysql import AsyncConnection
+from .models_to_test import Users
+import asyncio
+import unittest
+
+
+class TestAsync(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncConnection('sqlite://:memory:')
+        await self.db.create_tables(Users)
+        async with self.db.transaction():
+            await self.db.insert_many([Users(login=f'user_{i:02}', password='x') for i in range(30)])
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    async def test_a_select(self):
+        user = await self.db.select(Users).get(3)
+        self.assertEqual(user.login, 'user_02')
+        users = await self.db.select(Users).where(Users.user_id < 5).order_by(Users.user_id).all()
+        self.assertEqual([u.user_id for u in users], [1, 2, 3, 4])
+        user = await self.db.select(Users).where(Users.login == 'user_10').one()
+        self.assertEqual(user.user_id, 11)
+
+    async def test_b_async_for(self):
+        logins = [u.login async for u in self.db.select(Users).iter(batch_size=7)]
+        self.assertEqual(len(logins), 30)
+
+    async def test_c_do_and_rollback(self):
+        with self.assertRaises(RuntimeError):
+            async with self.db.transaction():
+                await self.db.delete(Users).where(Users.user_id > 10).do()
+                raise RuntimeError('rollback')
+        self.assertEqual(await self.db.select(Users).count(), 30)
+        self.assertTrue(await self.db.select(Users).where(Users.user_id == 30).exists())
+
+    async def test_d_concurrent(self):
+        other = AsyncConnection('sqlite://:memory:')
+        await other.create_tables(Users)
+        results = await asyncio.gather(self.db.select(Users).scalars(), other.select(Users).scalars())
+        self.assertEqual([len(r) for r in results], [30, 0])
+        await other.close()
+
+    async def test_e_page(self):
+        users, token = await self.db.select(Users).page_after(None, by=[Users.user_id]).limit(20).page()
+        self.assertEqual(len(users), 20)
+        users, token = await self.db.select(Users).page_after(token, by=[Users.user_id]).limit(20).page()
+        self.assertEqual((users[0].user_id, len(users), token), (21, 10, None))
+
+    async def test_f_upsert_many(self):
+        feed = [Users(login='user_00', password='new'), Users(login='fresh', password='x')]
+        await self.db.upsert_many(feed, conflict=[Users.login])
+        self.assertEqual(await self.db.select(Users).count(), 31)
+        self.assertEqual((await self.db.select(Users).get(1)).password, 'new')
+
+    async def test_g_builders_only(self):
+        query = self.db.select(Users).where(Users.user_id > 3).order_by(Users.user_id).limit(2)
+        self.assertIn('LIMIT ?', query.compile()[0])
+        self.assertIs(query.model, Users)
+        with self.assertRaises(AttributeError):
+            query._execute()
+        self.assertEqual([u.user_id for u in await query.all()], [4, 5])
+
+
+if __name__ == "__main__":
+    unittest.main()
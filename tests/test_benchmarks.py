@@ -0,0 +1,44 @@
+#!/usr/bin/python
+
+from benchmarks.__main__ import main
+from benchmarks.suite import compare, database, run
+from contextlib import redirect_stderr
+from io import StringIO
+import unittest
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_a_run(self):
+        report = run(sizes=[20], backends=['memory', 'file', 'null'], repeat=1)
+        for backend in ('memory', 'file', 'null'):
+            for case in ('build', 'insert_single', 'insert_bulk', 'select_all', 'get', 'hydrate', 'join_all', 'peak_memory'):
+                self.assertGreater(report['results'][f'{backend}/20/{case}']['value'], 0)
+        self.assertEqual(compare(report, report), [])
+
+    def test_b_compare(self):
+        baseline = {'results': {'a': {'value': 1.0, 'unit': 's', 'better': 'lower'},
+                                'b': {'value': 100, 'unit': 'rows/s', 'better': 'higher'},
+                                'c': {'value': 1.0, 'unit': 's', 'better': 'lower'}}}
+        report = {'results': {'a': {'value': 1.05, 'unit': 's', 'better': 'lower'},
+                              'b': {'value': 80, 'unit': 'rows/s', 'better': 'higher'},
+                              'c': {'value': 1.5, 'unit': 's', 'better': 'lower'},
+                              'd': {'value': 9.0, 'unit': 's', 'better': 'lower'}}}
+        self.assertEqual([r[0] for r in compare(report, baseline, tolerance=0.1)], ['b', 'c'])
+        self.assertEqual([r[0] for r in compare(report, baseline, tolerance=0.6)], [])
+
+    def test_c_backends(self):
+        with database('memory', 10) as db:
+            db.execute('PRAGMA journal_mode')
+            self.assertEqual(db.fetch_scalar(), 'memory')
+        with database('file', 10) as db:
+            db.execute('PRAGMA database_list')
+            self.assertTrue(db.fetch_tuples()[0][2].endswith('bench.db'))
+
+    def test_d_missing_baseline(self):
+        with redirect_stderr(StringIO()) as err:
+            self.assertEqual(main(['--baseline', 'missing/baseline.json']), 2)
+        self.assertIn('make bench-baseline', err.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
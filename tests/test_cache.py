@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+from angrysql import Connection
+from angrysql.cache import MemoryResultCache, SqliteResultCache
+from tempfile import TemporaryDirectory
+from .models_to_test import RateName
+import os
+import time
+import unittest
+
+
+class TestMemoryResultCache(unittest.TestCase):
+    def make_cache(self):
+        return MemoryResultCache(maxsize=8)
+
+    def setUp(self):
+        self.db = Connection('sqlite://:memory:')
+        self.db.create_tables(RateName)
+        self.db.insert_many([RateName(name=n) for n in ('day', 'night')])
+        self.cache = self.db.use_result_cache(self.make_cache())
+
+    def names(self):
+        return [r.name for r in self.db.select(RateName).order_by(RateName.name).cache().all()]
+
+    def test_a_hit(self):
+        self.assertEqual(self.names(), ['day', 'night'])
+        self.assertEqual(self.names(), ['day', 'night'])
+        self.assertEqual(self.db.select(RateName).order_by(RateName.name).cache().scalars(), [1, 2])
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_b_invalidate_on_write(self):
+        self.names()
+        self.db.insert(RateName(name='weekend')).do()
+        self.assertEqual(self.names(), ['day', 'night', 'weekend'])
+        self.db.delete(RateName).where(RateName.name == 'day').do()
+        self.assertEqual(self.names(), ['night', 'weekend'])
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_c_ttl(self):
+        self.db.select(RateName).cache(ttl=0.01).all()
+        time.sleep(0.02)
+        self.db.select(RateName).cache(ttl=0.01).all()
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_e_transaction_end(self):
+        self.db.commit()
+        self.db.begin()
+        self.db.insert(RateName(name='weekend')).do()
+        self.assertEqual(self.db.select(RateName).cache().count(), 3)
+        self.db.rollback()
+        self.assertEqual(self.db.select(RateName).cache().count(), 2)
+        with self.db.transaction():
+            self.db.insert(RateName(name='weekend')).do()
+            self.names()
+        self.names()
+        self.assertEqual(self.cache.hits, 0)
+
+
+class TestSqliteResultCache(TestMemoryResultCache):
+    def make_cache(self):
+        self.tmp = TemporaryDirectory()
+        return SqliteResultCache(os.path.join(self.tmp.name, 'cache.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def test_d_shared(self):
+        self.names()
+        other = SqliteResultCache(self.cache.path)
+        self.assertEqual(other.info()['entries'], 1)
+        other.invalidate('rate_name')
+        self.names()
+        self.assertEqual(self.cache.hits, 0)
+        other.close()
+
+    def test_f_read_only_hits(self):
+        self.names()
+        changes = self.cache._conn.total_changes
+        self.names()
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache._conn.total_changes, changes)
+        self.db.select(RateName).cache().scalars()
+        self.assertEqual(self.cache._used, {})
+
+
+class TestMemoryLimit(unittest.TestCase):
+    def test_a_evict_bytes(self):
+        cache = MemoryResultCache(max_bytes=400)
+        for i in range(10):
+            cache.put(('sql', (i,)), (('name',), [('x' * 50,)]), ('t',))
+        self.assertLessEqual(cache.size, 400)
+        self.assertLess(len(cache), 10)
+        self.assertIsNotNone(cache.get(('sql', (9,))))
+
+
+if __name__ == "__main__":
+    unittest.main()
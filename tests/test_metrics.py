@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+from angrysql import Connection
+from angrysql.metrics import statement_labels
+from .models_to_test import Users, RateName
+import unittest
+
+
+class TestHooks(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection('sqlite://:memory:')
+        self.db.create_tables(Users)
+        self.events = list()
+
+    def record(self, event):
+        def hook(db, *args):
+            self.assertIs(db, self.db)
+            self.events.append((event,) + args)
+        return self.db.on(event, hook)
+
+    def test_a_execute_hooks(self):
+        self.record('before_execute')
+        self.record('after_execute')
+        self.db.insert(Users(login='a', password='x')).do()
+        self.assertEqual(self.events[0][0], 'before_execute')
+        self.assertTrue(self.events[0][1].startswith('INSERT'))
+        event, sql, args, duration, rowcount = self.events[1]
+        self.assertEqual(event, 'after_execute')
+        self.assertGreaterEqual(duration, 0)
+        self.assertEqual(rowcount, 1)
+
+    def test_b_error_and_commit(self):
+        self.record('on_error')
+        self.record('on_commit')
+        with self.assertLogs('angrysql', 'ERROR'):
+            self.db.execute('SELECT * FROM missing_table')
+        self.db.commit()
+        self.assertEqual(self.events[0][0], 'on_error')
+        self.assertEqual(self.events[0][1], 'SELECT * FROM missing_table')
+        self.assertEqual(self.events[-1], ('on_commit',))
+
+    def test_c_hydrate(self):
+        self.db.insert_many([Users(login=f'u{i}', password='x') for i in range(3)])
+        hook = self.record('on_hydrate')
+        users = self.db.select(Users).all()
+        self.assertEqual(self.events, [('on_hydrate', Users, users)])
+        self.db.off('on_hydrate', hook)
+        self.db.select(Users).all()
+        self.assertEqual(len(self.events), 1)
+        self.assertRaises(ValueError, self.db.on, 'on_nothing', hook)
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection('sqlite://:memory:')
+        self.metrics = self.db.use_metrics()
+        self.db.create_tables(Users, RateName)
+
+    def series(self, kind, table):
+        for s in self.metrics.to_dict()['statements']:
+            if (s['kind'], s['table']) == (kind, table):
+                return s
+
+    def test_a_labels(self):
+        self.assertEqual(statement_labels('SELECT users.login FROM users WHERE 1'), ('SELECT', 'users'))
+        self.assertEqual(statement_labels('INSERT INTO rate_name (name) VALUES (?)'), ('INSERT', 'rate_name'))
+        self.assertEqual(statement_labels('UPDATE users SET login=?'), ('UPDATE', 'users'))
+        self.assertEqual(statement_labels('DELETE FROM users'), ('DELETE', 'users'))
+        self.assertEqual(statement_labels('CREATE TABLE IF NOT EXISTS users (a)'), ('CREATE', 'users'))
+        self.assertEqual(statement_labels('BEGIN'), ('BEGIN', ''))
+
+    def test_b_counts(self):
+        self.db.insert_many([Users(login=f'u{i}', password='x') for i in range(5)])
+        self.db.execute('UPDATE users SET password = ? WHERE user_id > ?', ('y', 2))
+        self.db.commit()
+        users = self.db.select(Users).all()
+        self.db.select(Users).columns(Users.login).scalars()
+
+        insert = self.series('INSERT', 'users')
+        self.assertEqual(insert['statements'], 1)
+        self.assertEqual(insert['rows_affected'], 5)
+        self.assertEqual(self.series('UPDATE', 'users')['rows_affected'], 3)
+        select = self.series('SELECT', 'users')
+        self.assertEqual(select['statements'], 2)
+        self.assertEqual(select['rows_fetched'], 10)
+        self.assertEqual(select['latency'][float('inf')], 2)
+        self.assertGreater(select['seconds'], 0)
+        data = self.metrics.to_dict()
+        self.assertEqual(data['hydrated'], {'Users': len(users)})
+        self.assertGreaterEqual(data['commits'], 2)
+
+    def test_c_prometheus(self):
+        with self.assertLogs('angrysql', 'ERROR'):
+            self.db.execute('SELECT * FROM missing_table')
+        self.db.select(Users).all()
+        text = self.metrics.prometheus()
+        self.assertIn('# TYPE angrysql_statements_total counter', text)
+        self.assertIn('angrysql_statements_total{kind="SELECT",table="users"} 1', text)
+        self.assertIn('angrysql_statement_errors_total{kind="SELECT",table="missing_table"} 1', text)
+        self.assertIn('angrysql_statement_duration_seconds_bucket{kind="SELECT",table="users",le="+Inf"} 1', text)
+        self.assertIn('angrysql_statement_duration_seconds_count{kind="SELECT",table="users"} 1', text)
+        self.assertTrue(text.endswith('\n'))
+
+    def test_d_shared_registry(self):
+        other = Connection('sqlite://:memory:')
+        self.assertIs(other.use_metrics(self.metrics), self.metrics)
+        self.assertIs(other.use_metrics(self.metrics), self.metrics)
+        other.create_tables(Users)
+        self.db.select(Users).all()
+        other.select(Users).all()
+        self.assertEqual(self.series('SELECT', 'users')['statements'], 2)
+        self.metrics.reset()
+        self.assertEqual(self.metrics.to_dict()['statements'], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+
+from angrysql import Connection
+from angrysql.null import NullConnection, result_columns
+from .models_to_test import Users, Tags
+import unittest
+
+
+class TestNull(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection('null://?rows=3')
+        self.db.create_tables(Users, Tags)
+
+    def test_a_url(self):
+        self.assertIsInstance(self.db, NullConnection)
+        self.assertEqual(self.db.driver.rows, 3)
+        self.assertRaises(ValueError, Connection, 'nosuchdb://x')
+
+    def test_b_result_columns(self):
+        self.assertEqual(result_columns('SELECT users.user_id,users.login FROM users WHERE users.user_id = ?'),
+                         ('user_id', 'login'))
+        self.assertEqual(result_columns('SELECT users.login AS users_login, COUNT(x, y) FROM users'),
+                         ('users_login', 'COUNT(x, y)'))
+        self.assertEqual(result_columns('SELECT 1'), ('1',))
+        self.assertEqual(result_columns('INSERT INTO users (login) VALUES (?)'), ())
+
+    def test_c_synthetic_rows(self):
+        users = self.db.select(Users).all()
+        self.assertEqual([u.user_id for u in users], [1, 2, 3])
+        self.assertEqual(users[1].login, 'login_1')
+        self.assertEqual([t.name for t in self.db.select(Tags).all()], ['name_0', 'name_1', 'name_2'])
+        self.assertEqual(self.db.select(Users).get(5).user_id, 1)
+        self.assertEqual(len(list(self.db.select(Users).iter(batch_size=2))), 3)
+        self.db.driver.rows = 10
+        self.assertEqual(len(self.db.select(Users).scalars()), 10)
+
+    def test_d_records(self):
+        self.db.insert(Users(login='x', password='y')).do()
+        self.db.insert_many([Users(login=f'u{i}', password='y') for i in range(4)])
+        self.db.commit()
+        sql, args = self.db.statements[-2]
+        self.assertEqual(sql, 'INSERT INTO users (login,password) VALUES (?,?)')
+        self.assertEqual(args, ('x', 'y'))
+        self.assertEqual(len(self.db.statements[-1][1]), 4)
+        self.assertEqual(self.db.driver.commits, 2)
+
+    def test_e_value_factory(self):
+        db = NullConnection(rows=2, value=lambda name, i: i * 10, record=0)
+        self.assertEqual(db.select(Users).columns(Users.user_id).scalars(), [0, 10])
+        self.assertEqual(len(db.statements), 0)
+        self.assertEqual(db.driver.executed, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+
+from angrysql import Connection
+from angrysql.pool import PoolTimeout
+from .models_to_test import Users
+from tempfile import TemporaryDirectory
+from threading import Thread
+import os
+import time
+import unittest
+
+
+class TestPool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.url = f"sqlite://{os.path.join(self.tmp.name, 'pool.db')}"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_a_reuse(self):
+        pool = Connection(self.url, pool_size=2)
+        with pool.connection() as db:
+            first = db
+        with pool.connection() as db:
+            self.assertIs(db, first)
+        stats = pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_b_overflow_and_timeout(self):
+        pool = Connection(self.url, pool_size=1, max_overflow=1, pool_timeout=0.05)
+        first = pool.checkout()
+        second = pool.checkout()
+        self.assertEqual(pool.stats()['overflow'], 1)
+        self.assertRaises(PoolTimeout, pool.checkout)
+        pool.checkin(second)
+        pool.checkin(first)
+        stats = pool.stats()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['opened'], 1)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_c_recycle_max_uses(self):
+        pool = Connection(self.url, pool_size=1, pool_max_uses=2)
+        seen = list()
+        for i in range(3):
+            with pool.connection() as db:
+                seen.append(db)
+        self.assertIs(seen[0], seen[1])
+        self.assertIsNot(seen[1], seen[2])
+        self.assertEqual(pool.stats()['recycled'], 1)
+
+    def test_d_pre_ping(self):
+        pool = Connection(self.url, pool_size=1)
+        with pool.connection() as db:
+            dead = db
+            dead.ping = lambda: False
+        with pool.connection() as db:
+            self.assertIsNot(db, dead)
+            self.assertTrue(db.ping())
+        self.assertEqual(pool.stats()['invalidated'], 1)
+
+    def test_e_threads_wait(self):
+        pool = Connection(self.url, pool_size=2, pool_timeout=5)
+        errors = list()
+
+        def worker():
+            try:
+                with pool.connection() as db:
+                    time.sleep(0.01)
+                    self.assertTrue(db.ping())
+            except Exception as err:
+                errors.append(err)
+
+        threads = [Thread(target=worker) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(pool.stats()['created'], 2)
+        self.assertEqual(pool.stats()['checked_out'], 0)
+
+    def test_f_threads_query(self):
+        pool = Connection(self.url, pool_size=4)
+        with pool.connection() as db:
+            db.create_tables(Users)
+        errors = list()
+
+        def worker(n):
+            try:
+                with pool.connection() as db:
+                    for i in range(20):
+                        db.insert(Users(login=f'thread_{n}_{i}', password='x')).do()
+                    db.commit()
+                    logins = db.select(Users).columns(Users.login).where(Users.login.like(f'thread_{n}_%')).scalars()
+                    self.assertEqual(len(logins), 20)
+            except Exception as err:
+                errors.append(err)
+
+        threads = [Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        with pool.connection() as db:
+            self.assertEqual(len(db.select(Users).scalars()), 80)
+
+
+if __name__ == "__main__":
+    unittest.main()
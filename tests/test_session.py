@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+from angrysql import Connection
+from .models_to_test import Users, Tags
+import unittest
+
+
+class DatabaseCase(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection('sqlite://:memory:')
+        self.db.create_tables(Users, Tags)
+        self.db.insert_many([Users(login=f'user_{i}', password='secret', email=f'{i}@x') for i in range(1, 4)])
+        self.db.insert_many([Tags(name=f'tag_{i}', description='text') for i in range(1, 4)])
+        self.db.commit()
+        self.statements = list()
+        self.db.on('before_execute', lambda db, sql, args: self.statements.append((sql, args)))
+
+
+class TestDirtyTracking(DatabaseCase):
+    def test_a_changes(self):
+        user = self.db.select(Users).get(1)
+        self.assertEqual(user._changes(), [])
+        user.email = 'new@x'
+        self.assertEqual([(c.column_name, v) for c, v in user._changes()], [('email', 'new@x')])
+        user._mark_clean()
+        self.assertEqual(user._changes(), [])
+        self.assertEqual(len(Users(login='a', password='b')._changes()), 2)
+
+    def test_b_compact_changes(self):
+        tag = self.db.select(Tags).get(2)
+        self.assertEqual(tag._changes(), [])
+        tag.description = 'other'
+        self.assertEqual([(c.column_name, v) for c, v in tag._changes()], [('description', 'other')])
+
+    def test_c_update_sends_changed_columns(self):
+        user = self.db.select(Users).get(1)
+        user.email = 'changed@x'
+        self.db.update(user).where(Users.user_id == 1).do()
+        self.assertEqual(self.statements[-1], ('UPDATE users SET email = ? WHERE users.user_id = ?', ('changed@x', 1)))
+        self.assertEqual(self.db.update(user).where(Users.user_id == 1).do(), 0)
+        self.assertEqual(len(self.statements), 2)
+        self.assertEqual(self.db.select(Users).get(1).email, 'changed@x')
+
+
+class TestSession(DatabaseCase):
+    def test_d_flush_groups_updates(self):
+        session = self.db.session()
+        users = self.db.select(Users).all()
+        session.add_all(users)
+        users[0].email = 'a@y'
+        users[1].email = 'b@y'
+        users[2].password = 'changed'
+        self.assertEqual(len(session.dirty()), 3)
+        self.assertEqual(session.flush(), 3)
+        self.assertEqual(session.dirty(), [])
+        self.assertEqual(self.db.select(Users).columns(Users.email).order_by(Users.user_id).scalars(), ['a@y', 'b@y', '3@x'])
+        self.assertEqual(self.db.select(Users).get(3).password, 'changed')
+        self.assertEqual(session.flush(), 0)
+
+    def test_e_executemany_batches(self):
+        sent = list()
+        self.db.executemany = lambda sql, rows: sent.append((sql, rows))
+        with self.db.session() as session:
+            for tag in self.db.select(Tags).all():
+                tag.description = f'd{tag.tag_id}'
+                session.add(tag)
+        self.assertEqual(sent, [('UPDATE tags SET description = ? WHERE tag_id = ?', [('d1', 1), ('d2', 2), ('d3', 3)])])
+
+    def test_f_new_models_are_inserted(self):
+        with self.db.transaction(), self.db.session() as session:
+            session.add(Users(login='fresh', password='x'))
+            user = self.db.select(Users).get(2)
+            user.login = 'renamed'
+            session.add(user)
+        self.assertEqual(self.db.select(Users).columns(Users.login).order_by(Users.user_id).scalars(),
+                         ['user_1', 'renamed', 'user_3', 'fresh'])
+
+    def test_g_primary_key_change(self):
+        session = self.db.session()
+        user = session.add(self.db.select(Users).get(3))
+        user.user_id = 30
+        session.flush()
+        self.assertIsNone(self.db.select(Users).get(3))
+        self.assertEqual(self.db.select(Users).get(30).login, 'user_3')
+
+    def test_h_flush_after_insert(self):
+        session = self.db.session()
+        user = session.add(Users(login='fresh', password='x'))
+        self.assertEqual(session.flush(), 1)
+        self.assertEqual(user.user_id, 4)
+        user.email = 'fresh@x'
+        self.assertEqual(session.flush(), 1)
+        self.assertEqual(self.db.select(Users).get(4).email, 'fresh@x')
+
+    def test_i_failed_insert_stays_dirty(self):
+        session = self.db.session()
+        clash = session.add(Users(login='user_1', password='x'))
+        with self.assertLogs('angrysql', 'ERROR'):
+            self.assertEqual(session.flush(), 0)
+        self.assertEqual(session.dirty(), [clash])
+
+
+if __name__ == "__main__":
+    unittest.main()
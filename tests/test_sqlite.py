@@ -1,8 +1,15 @@
 #!/usr/bin/python
 
-from angrysql import Connection
-from angrysql.base import Insert
+from angrysql import Connection, or_, count, UNSET
+from angrysql.base import Insert, Select
+from angrysql.schema import Function
+from angrysql.sqlite import PRESETS, sqlite_pragmas
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+import logging
 from hashlib import sha256
+from tempfile import TemporaryDirectory
+import sqlite3
 from .models_to_test import *
 import unittest
 
@@ -16,8 +23,16 @@ class TestSqlite(unittest.TestCase):
         cls.db = Connection('sqlite://test.db', echo=True)
         
     def test_a_creeate_tables(self):
-        self.assertIsNone(self.db.create_tables(Users, UserRates, RateName, Addons, WorkDays))
+        self.assertIsNone(self.db.create_tables(Users, UserRates, RateName, Addons, WorkDays, Tags))
         
+    def test_a_indexes(self):
+        self.db.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%' ORDER BY name")
+        indexes = dict(self.db.fetch_tuples())
+        self.assertEqual(sorted(indexes), ['ix_tags_description', 'ix_user_rates_rate_name_id',
+                                           'ix_user_rates_user_id', 'ix_work_days_user_id_year_month'])
+        self.assertIn('(user_id,year,month,day)', indexes['ix_work_days_user_id_year_month'])
+        self.assertIn('WHERE tags.description IS NOT NULL', indexes['ix_tags_description'])
+
     def test_b_insert(self):
         for i in range(0,100):
             u = Users(login=f'user_{i:02}', password=sha256(f'user_{i}'.encode()).hexdigest(), email=f'user_{i}@test.org')
@@ -25,6 +40,21 @@ class TestSqlite(unittest.TestCase):
             print(ret)
             self.assertIsInstance(ret , int)
     
+    def test_b_insert_many(self):
+        users = [Users(login=f'bulk_{i:03}', password='x') for i in range(250)]
+        self.assertEqual(self.db.insert_many(users, chunk_size=100), 250)
+        self.assertEqual(self.db.select(Users).get(users[-1].user_id).login, 'bulk_249')
+        self.assertEqual(len({u.user_id for u in users}), 250)
+        self.assertEqual(self.db.delete(Users).where(Users.login.like('bulk_%')).do(), 250)
+
+    def test_b_insert_compact(self):
+        tag = Tags(name='compact')
+        self.assertIs(tag.description, UNSET)
+        self.assertFalse(hasattr(tag, '__dict__'))
+        self.assertEqual(self.db.insert(tag).sql, 'INSERT INTO tags (name) VALUES (?)')
+        self.db.delete(Tags).where(Tags.name == 'compact').do()
+        self.assertEqual(self.db.insert(tag).do(), 1)
+
     def test_c_commit(self):
         self.db.commit()
     
@@ -50,6 +80,18 @@ class TestSqlite(unittest.TestCase):
             tprint(i)
         self.assertIsInstance(u, list)
     
+    def test_d_select_iter(self):
+        query = self.db.select(Users).where(Users.user_id <= 20)
+        streamed = [u.login for u in query.iter(batch_size=7)]
+        self.assertEqual(streamed, [u.login for u in query.all()])
+        self.assertEqual(len(list(self.db.select(Users))), len(self.db.select(Users).all()))
+
+    def test_d_select_compact(self):
+        tag = self.db.select(Tags).where(Tags.name == 'compact').one()
+        self.assertIsInstance(tag, Tags)
+        self.assertEqual(tag.name, 'compact')
+        self.assertIsNone(tag.description)
+
     def test_e01_select_where(self):
         u = self.db.select(Users).where(Users.login == 'user_99').all()
         tprint(u)
@@ -60,7 +102,9 @@ class TestSqlite(unittest.TestCase):
         for i in u:
             tprint(i.login)
             tprint(i.email)
+            self.assertIsNone(i.email)
         self.assertIsInstance(u, list)
+        self.assertIn(('login',), Users.__hydrators__)
     
     def test_e03_select_like(self):
         u = self.db.select(Users).where(Users.login.like('user_0_')).all()
@@ -89,6 +133,67 @@ class TestSqlite(unittest.TestCase):
             tprint(f"{i.login} {i.user_id}")
         self.assertIsInstance(u, list)
     
+    def test_e061_select_bound_args(self):
+        q = self.db.select(Users).where(Users.login == "user_0'1", Users.user_id.in_(1, 2))
+        self.assertEqual(q.sql, 'SELECT users.user_id,users.login,users.password,users.email FROM users '
+                                'WHERE users.login = ? AND users.user_id IN (?, ?)')
+        self.assertEqual(q.args, ("user_0'1", 1, 2))
+        self.assertEqual(q.all(), [])
+
+    def test_e062_select_or(self):
+        u = self.db.select(Users).where(Users.user_id < 5, or_(Users.login == 'user_01', Users.login == 'user_02')).all()
+        self.assertEqual(sorted(i.login for i in u), ['user_01', 'user_02'])
+
+    def test_e063_statement_cache(self):
+        Users.__statements__.clear()
+        first = self.db.select(Users).where(Users.login == 'user_01').compile()
+        second = self.db.select(Users).where(Users.login == 'user_02').compile()
+        self.assertEqual(first[0], second[0])
+        self.assertEqual(second[1], ('user_02',))
+        self.assertEqual(Users.__statements__.info()['hits'], 1)
+        self.assertEqual(Users.__statements__.info()['misses'], 1)
+
+    def test_e064_select_raw_results(self):
+        query = self.db.select(Users).columns(Users.user_id, Users.login).where(Users.user_id.in_(1, 2)).order_by(Users.user_id)
+        self.assertEqual(query.tuples(), [(1, 'user_00'), (2, 'user_01')])
+        self.assertEqual(query.dicts(), [{'user_id': 1, 'login': 'user_00'}, {'user_id': 2, 'login': 'user_01'}])
+        self.assertEqual(query.scalars(), [1, 2])
+        self.assertEqual(query.first_scalar(), 1)
+        self.assertIsNone(self.db.select(Users).where(Users.user_id < 0).first_scalar())
+
+    def test_e065_join_raw_results(self):
+        rows = self.db.join(Users.login, Tags.name).inner(Tags, Tags.tag_id > 0).where(Users.user_id == 1).dicts()
+        self.assertEqual(rows, [{'users_login': 'user_00', 'tags_name': 'compact'}])
+
+    def test_e066_independent_connections(self):
+        other = Connection('sqlite://:memory:')
+        other.create_tables(Users)
+        other.insert(Users(login='other', password='x')).do()
+        self.assertEqual(other.select(Users).scalars(), [1])
+        self.assertEqual(self.db.select(Users).where(Users.login == 'other').all(), [])
+        self.assertIs(self.db.select(Users).__db__, self.db)
+        self.assertIsNone(Select.__db__)
+
+    def test_e067_limit_offset(self):
+        query = self.db.select(Users).columns(Users.user_id).order_by(Users.user_id)
+        self.assertEqual(query.limit(3).offset(5).scalars(), [6, 7, 8])
+        self.assertEqual(self.db.select(Users).columns(Users.user_id).order_by(Users.user_id).offset(98).scalars(), [99, 100])
+
+    def test_e068_keyset_pages(self):
+        by = [Users.login, Users.user_id]
+        expected = self.db.select(Users).columns(Users.login).order_by(*by, desc=True).scalars()
+        seen = list()
+        token = None
+        while True:
+            rows, token = self.db.select(Users).page_after(token, by=by, desc=True).limit(30).page()
+            seen.extend([u.login for u in rows])
+            if token is None:
+                break
+        self.assertEqual(seen, expected)
+        query = self.db.select(Users).page_after(('user_50', 51), by=by).limit(2)
+        self.assertIn('(users.login, users.user_id) > (?, ?)', query.sql)
+        self.assertEqual([u.login for u in query.all()], ['user_51', 'user_52'])
+
     def test_e07_delete_where(self):
         u = self.db.delete(Users).where(Users.user_id > 10).do()
         tprint(u)
@@ -97,5 +202,473 @@ class TestSqlite(unittest.TestCase):
         
     
 
+class TestTransactions(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection('sqlite://:memory:')
+        self.db.create_tables(RateName)
+        self.statements = list()
+        self.db.on('before_execute', lambda db, sql, args: self.statements.append(sql))
+
+    def names(self):
+        return self.db.select(RateName).columns(RateName.name).order_by(RateName.name).scalars()
+
+    def test_a_commit_and_rollback(self):
+        with self.db.transaction():
+            self.db.insert(RateName(name='day')).do()
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction():
+                self.db.insert(RateName(name='night')).do()
+                raise RuntimeError('rollback')
+        self.assertEqual(self.names(), ['day'])
+
+    def test_b_savepoint(self):
+        with self.db.transaction():
+            self.db.insert(RateName(name='day')).do()
+            with self.assertRaises(RuntimeError):
+                with self.db.transaction():
+                    self.db.insert(RateName(name='night')).do()
+                    raise RuntimeError('rollback inner')
+            with self.db.transaction():
+                self.db.insert(RateName(name='weekend')).do()
+        self.db.rollback()
+        self.assertEqual(self.names(), ['day', 'weekend'])
+
+    def test_b_driver_error(self):
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.assertLogs('angrysql', 'ERROR'), self.db.transaction():
+                self.db.insert(RateName(name='day')).do()
+                query = self.db.insert(RateName(name='day'))
+                query.do()
+                self.assertIsInstance(query.errors, sqlite3.IntegrityError)
+        self.assertEqual(self.names(), [])
+        with self.db.transaction():
+            self.db.insert(RateName(name='day')).do()
+            with self.assertRaises(sqlite3.IntegrityError), self.assertLogs('angrysql', 'ERROR'):
+                with self.db.transaction():
+                    self.db.insert(RateName(name='night')).do()
+                    self.db.insert(RateName(name='day')).do()
+        self.assertEqual(self.names(), ['day'])
+
+    def test_c_group_commit(self):
+        with self.db.group_commit(max_writes=3, max_delay=60):
+            for name in ('a', 'b'):
+                self.db.insert(RateName(name=name)).do()
+                self.db.commit()
+            self.assertEqual(self.db._pending_commits, 2)
+            self.assertEqual(self.statements.count('RELEASE SAVEPOINT group_commit'), 1)
+            self.db.insert(RateName(name='lost')).do()
+            self.db.rollback()
+            self.db.insert(RateName(name='c')).do()
+            self.db.commit()
+            self.assertEqual(self.db._pending_commits, 0)
+            self.db.insert(RateName(name='d')).do()
+            self.db.commit()
+        self.db.rollback()
+        self.assertEqual(self.names(), ['a', 'b', 'c', 'd'])
+
+
+class TestPageTokens(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection('sqlite://:memory:')
+        self.db.create_tables(Users, RateName, UserRates, WorkDays)
+        self.db.insert(Users(login='user', password='x')).do()
+        start = datetime(2020, 1, 1, 8)
+        self.db.insert_many([WorkDays(user_id=1, day=i, month=1, year=2020, end=0,
+                                      start=str(start + timedelta(hours=i // 2))) for i in range(7)])
+
+    def test_a_round_trip(self):
+        values = [datetime(2020, 1, 2, 3, 4, 5, 6), date(2020, 1, 2), time(3, 4), Decimal('1.50'), b'\x00\xff', 'a', 1]
+        self.assertEqual(Select.decode_token(Select.encode_token(values)), values)
+        self.assertRaises(TypeError, Select.encode_token, [object()])
+        self.assertRaises(ValueError, Select.decode_token, Select.encode_token([{'$type': 'x', 'value': 1}]))
+
+    def test_b_page_on_timestamp(self):
+        def timestamps(db, model, instances):
+            # MySQL returns TIMESTAMP columns as datetime
+            for day in instances:
+                day.start = datetime.fromisoformat(day.start)
+        self.db.on('on_hydrate', timestamps)
+        by = [WorkDays.start, WorkDays.work_days_id]
+        seen = list()
+        token = None
+        while True:
+            rows, token = self.db.select(WorkDays).page_after(token, by=by).limit(3).page()
+            seen.extend([d.day for d in rows])
+            if token is None:
+                break
+        self.assertEqual(seen, list(range(7)))
+
+
+class TestIdentityMap(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection('sqlite://:memory:')
+        self.db.create_tables(Users)
+        self.db.insert_many([Users(login=f'user_{i}', password='x') for i in range(5)])
+        self.cache = self.db.use_identity_map(maxsize=2)
+
+    def test_a_get_cached(self):
+        user = self.db.select(Users).get(1)
+        self.assertIs(self.db.select(Users).get(1), user)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertIsNone(self.db.select(Users).get(100))
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_b_invalidate_on_write(self):
+        user = self.db.select(Users).get(1)
+        user.email = 'changed@test.org'
+        self.db.update(user).where(Users.user_id == 1).do()
+        self.assertIsNot(self.db.select(Users).get(1), user)
+        self.db.delete(Users).where(Users.user_id == 1).do()
+        self.assertIsNone(self.db.select(Users).get(1))
+
+    def test_b_savepoint_rollback(self):
+        with self.db.transaction():
+            with self.assertRaises(RuntimeError), self.db.transaction():
+                self.db.execute('UPDATE users SET email = ? WHERE user_id = 1', ('changed',))
+                self.assertEqual(self.db.select(Users).get(1).email, 'changed')
+                raise RuntimeError('rollback inner')
+            self.assertIsNone(self.db.select(Users).get(1).email)
+
+    def test_c_lru_eviction(self):
+        for i in (1, 2, 3):
+            self.db.select(Users).get(i)
+        self.assertEqual(len(self.cache), 2)
+        self.db.select(Users).get(1)
+        self.assertEqual(self.cache.hits, 0)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection('sqlite://:memory:')
+        self.db.create_tables(Users)
+
+    def test_a_errors_logged_and_returned(self):
+        with self.assertLogs('angrysql', 'ERROR') as logs:
+            err = self.db.execute('SELECT * FROM missing_table')
+        self.assertIsInstance(err, sqlite3.OperationalError)
+        self.assertEqual(logs.records[0].sql, 'SELECT * FROM missing_table')
+
+    def test_b_echo_logs_timing(self):
+        self.db.echo = True
+        with self.assertLogs('angrysql', 'INFO') as logs:
+            self.db.select(Users).all()
+        self.assertIn('SELECT', logs.output[0])
+        self.assertIn('ms]', logs.output[0])
+        self.assertGreater(self.db.last_duration, 0)
+
+    def test_b_echo_respects_configured_logging(self):
+        log = logging.getLogger('angrysql')
+        root = logging.getLogger()
+        saved = (log.handlers[:], log.level, root.handlers[:])
+        log.handlers, root.handlers = [], [logging.NullHandler()]
+        log.setLevel(logging.NOTSET)
+        try:
+            Connection('sqlite://:memory:', echo=True)
+            self.assertEqual((log.handlers, log.level), ([], logging.NOTSET))
+            root.handlers = []
+            Connection('sqlite://:memory:', echo=True)
+            self.assertEqual(len(log.handlers), 1)
+            self.assertEqual(log.level, logging.INFO)
+        finally:
+            log.handlers, log.level, root.handlers = saved
+
+    def test_c_slow_query_explain(self):
+        self.db.log_slow_queries(threshold=0, explain=True, keep=2)
+        with self.assertLogs('angrysql.slow', 'WARNING') as logs:
+            self.db.select(Users).where(Users.login == 'x').all()
+        entry = self.db.slow_queries[-1]
+        self.assertTrue(entry.sql.startswith('SELECT'))
+        self.assertEqual(entry.args, ('x',))
+        self.assertTrue(entry.plan)
+        self.assertIs(logs.records[0].plan, entry.plan)
+        self.db.insert_many([Users(login=f'u{i}', password='x') for i in range(3)])
+        self.assertEqual(len(self.db.slow_queries), 2)
+
+    def test_d_slow_query_threshold(self):
+        self.db.log_slow_queries(threshold=60)
+        self.db.select(Users).all()
+        self.assertEqual(len(self.db.slow_queries), 0)
+        self.assertIsNone(self.db.explain('SELECT * FROM missing_table'))
+
+
+class TestPragmas(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.path = f"{self.tmp.name}/pragmas.db"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def pragma(self, db, name):
+        db.execute(f'PRAGMA {name}')
+        return db.fetch_scalar()
+
+    def test_a_url_params(self):
+        db = Connection(f'sqlite://{self.path}?journal_mode=wal&synchronous=normal&cache_size=-2000'
+                        '&mmap_size=1048576&busy_timeout=250&temp_store=memory')
+        self.assertEqual(self.pragma(db, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(db, 'synchronous'), 1)
+        self.assertEqual(self.pragma(db, 'cache_size'), -2000)
+        self.assertEqual(self.pragma(db, 'busy_timeout'), 250)
+        self.assertEqual(self.pragma(db, 'temp_store'), 2)
+        self.assertEqual(self.pragma(db, 'foreign_keys'), 1)
+        db.close()
+
+    def test_b_production_preset(self):
+        db = Connection(f'sqlite://{self.path}?preset=production&busy_timeout=100')
+        self.assertEqual(self.pragma(db, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(db, 'cache_size'), PRESETS['production']['cache_size'])
+        self.assertEqual(self.pragma(db, 'busy_timeout'), 100)
+        db.close()
+
+    def test_c_validation(self):
+        self.assertEqual(list(sqlite_pragmas({'temp_store': 'memory', 'busy_timeout': '10'})),
+                         ['busy_timeout', 'temp_store', 'foreign_keys'])
+        self.assertRaises(ValueError, sqlite_pragmas, {'journal_mode': 'fast'})
+        self.assertRaises(ValueError, sqlite_pragmas, {'cache_size': 'big'})
+        self.assertRaises(ValueError, sqlite_pragmas, {'mmap_size': '-1'})
+        self.assertRaises(ValueError, sqlite_pragmas, {'page_size': '4096'})
+        self.assertRaises(ValueError, sqlite_pragmas, {'preset': 'fastest'})
+        self.assertRaises(ValueError, Connection, f'sqlite://{self.path}?synchronous=sometimes')
+
+
+class TestUpsert(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection('sqlite://:memory:')
+        self.db.create_tables(Users, Tags)
+        self.db.insert_many([Users(login=f'user_{i}', password='old', email=f'{i}@old') for i in range(3)])
+
+    def logins(self):
+        return self.db.select(Users).columns(Users.login, Users.password, Users.email).order_by(Users.user_id).tuples()
+
+    def test_a_upsert_many(self):
+        feed = [Users(login=f'user_{i}', password='new', email=f'{i}@new') for i in range(1, 5)]
+        self.db.upsert_many(feed, conflict=[Users.login], chunk_size=3)
+        self.assertEqual(self.logins(), [('user_0', 'old', '0@old'),
+                                         ('user_1', 'new', '1@new'),
+                                         ('user_2', 'new', '2@new'),
+                                         ('user_3', 'new', '3@new'),
+                                         ('user_4', 'new', '4@new')])
+
+    def test_b_update_columns(self):
+        self.db.upsert_many([Users(login='user_1', password='new', email='1@new'),
+                             Users(login='user_9', password='new', email='9@new')],
+                            conflict=[Users.login], update=[Users.email])
+        self.assertEqual(self.logins()[1], ('user_1', 'old', '1@new'))
+        self.assertEqual(self.logins()[-1], ('user_9', 'new', '9@new'))
+
+    def test_c_do_nothing(self):
+        self.db.upsert_many([Users(login='user_1', password='new')], conflict=[Users.login], update=[])
+        self.assertEqual(self.logins()[1], ('user_1', 'old', '1@old'))
+
+    def test_d_compact_and_invalidation(self):
+        self.db.insert(Tags(name='a', description='old')).do()
+        self.db.use_identity_map()
+        self.assertEqual(self.db.select(Tags).get(1).description, 'old')
+        self.db.upsert_many([Tags(name='a', description='new')], conflict=[Tags.name])
+        self.assertEqual(self.db.select(Tags).get(1).description, 'new')
+
+    def test_e_sql(self):
+        sql, args = self.db.insert(Users(login='a', password='b')).on_conflict([Users.login]).compile()
+        self.assertEqual(sql, 'INSERT INTO users (login,password) VALUES (?,?) '
+                              'ON CONFLICT (login) DO UPDATE SET password = excluded.password')
+        self.assertRaises(ValueError, self.db.insert(Users(login='a')).on_conflict, [Users.login], [Users.email])
+        self.assertRaises(ValueError, self.db.insert(Users(login='a')).on_conflict, [])
+
+
+class TestJoin(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection('sqlite://:memory:')
+        self.db.create_tables(Users, UserRates, RateName, Tags)
+        self.db.insert_many([Users(login=f'user_{i}', password='x') for i in range(3)])
+        self.db.insert_many([RateName(name='day'), RateName(name='night')])
+        self.db.insert_many([UserRates(user_id=1, rate_name_id=1, value=5),
+                             UserRates(user_id=1, rate_name_id=2, value=7),
+                             UserRates(user_id=2, rate_name_id=1, value=9)])
+
+    def test_a_model_tuples(self):
+        rows = self.db.join(Users, UserRates, RateName.name) \
+            .inner(UserRates, UserRates.user_id == Users.user_id) \
+            .inner(RateName, RateName.rate_name_id == UserRates.rate_name_id) \
+            .order_by(UserRates.rate_id).all()
+        self.assertEqual(len(rows), 3)
+        user, rate, name = rows[0]
+        self.assertIsInstance(user, Users)
+        self.assertIsInstance(rate, UserRates)
+        self.assertIsInstance(name, RateName)
+        self.assertEqual((user.login, rate.value, name.name, name.rate_name_id), ('user_0', 5, 'day', None))
+        self.assertEqual([(u.user_id, r.value) for u, r, n in rows], [(1, 5), (1, 7), (2, 9)])
+
+    def test_b_left_join(self):
+        rows = self.db.join(Users.login, UserRates.value) \
+            .left(UserRates, UserRates.user_id == Users.user_id) \
+            .where(Users.user_id == 3).all()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][0].login, 'user_2')
+        self.assertIsNone(rows[0][1])
+
+    def test_c_cached_result_class(self):
+        def query():
+            return self.db.join(Users.login, UserRates.value).inner(UserRates, UserRates.user_id == Users.user_id)
+        first = query()._result_model()
+        self.assertIs(query()._result_model(), first)
+        query().all()
+        self.assertEqual(len(first.__hydrators__), 1)
+        self.assertIsNot(query().left(RateName, RateName.rate_name_id == UserRates.rate_name_id)._result_model(), first)
+
+    def test_d_one_and_iter(self):
+        user, rate = self.db.join(Users, UserRates.value).inner(UserRates, UserRates.user_id == Users.user_id) \
+            .where(UserRates.value == 9).one()
+        self.assertEqual((user.user_id, rate.value), (2, 9))
+        rows = list(self.db.join(Users, UserRates).inner(UserRates, UserRates.user_id == Users.user_id).iter(batch_size=2))
+        self.assertEqual(len(rows), 3)
+        rows[0][1].value = 1
+        self.assertEqual([c.column_name for c, v in rows[0][1]._changes()], ['value'])
+
+    def test_d_null_values_and_columns(self):
+        self.db.execute('UPDATE user_rates SET value = NULL WHERE rate_id = 3')
+        rows = self.db.join(Users.login, UserRates.value).left(UserRates, UserRates.user_id == Users.user_id) \
+            .where(Users.user_id > 1).order_by(Users.user_id).all()
+        self.assertEqual(rows[0][1].value, None)
+        self.assertIsNone(rows[1][1])
+        query = self.db.join(Users, UserRates).inner(UserRates, UserRates.user_id == Users.user_id).columns(Users.login)
+        self.assertRaises(ValueError, query.all)
+        self.assertEqual(query.scalars(), ['user_0', 'user_0', 'user_1'])
+
+    def test_e_compact_models(self):
+        self.db.insert(Tags(name='t', description='d')).do()
+        user, tag = self.db.join(Users.login, Tags.name).inner(Tags, Tags.tag_id > 0).where(Users.user_id == 1).one()
+        self.assertEqual((user.login, tag.name, tag.description), ('user_0', 't', None))
+        tag.name = 'u'
+        self.assertEqual([c.column_name for c, v in tag._changes()], ['name'])
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection('sqlite://:memory:')
+        self.db.create_tables(Users, RateName, UserRates, WorkDays)
+        self.db.insert_many([Users(login=f'user_{i}', password='x') for i in range(4)])
+        self.db.insert_many([WorkDays(user_id=i % 3 + 1, day=i, month=1, year=2020, start=0, end=1) for i in range(9)])
+        self.statements = list()
+        self.db.on('before_execute', lambda db, sql, args: self.statements.append(sql))
+
+    def test_a_many_to_one(self):
+        days = self.db.select(WorkDays).prefetch(WorkDays.user_id).all()
+        self.assertEqual(len(self.statements), 2)
+        self.assertEqual([d.related(WorkDays.user_id).user_id for d in days], [d.user_id for d in days])
+        self.assertIn('WHERE users.user_id IN (?, ?, ?)', self.statements[1])
+
+    def test_b_one_to_many(self):
+        users = self.db.select(Users).select_related(WorkDays.user_id).all()
+        self.assertEqual(len(self.statements), 2)
+        self.assertEqual([[d.day for d in u.related(WorkDays.user_id)] for u in users],
+                         [[0, 3, 6], [1, 4, 7], [2, 5, 8], []])
+
+    def test_c_chunks(self):
+        self.db.max_placeholders = 2
+        days = self.db.select(WorkDays).prefetch(WorkDays.user_id).all()
+        self.assertEqual(len(self.statements), 3)
+        self.assertEqual(days[-1].related(WorkDays.user_id).login, 'user_2')
+
+    def test_d_one_and_errors(self):
+        day = self.db.select(WorkDays).where(WorkDays.day == 4).prefetch(WorkDays.user_id).one()
+        self.assertEqual(day.related(WorkDays.user_id).login, 'user_1')
+        user = self.db.select(Users).get(1)
+        self.assertRaises(LookupError, user.related, WorkDays.user_id)
+        self.assertRaises(ValueError, self.db.prefetch, [user], Users.login)
+        self.assertRaises(ValueError, self.db.prefetch, [user], UserRates.rate_name_id)
+
+    def test_d_iter(self):
+        days = list(self.db.select(WorkDays).prefetch(WorkDays.user_id).iter(batch_size=4))
+        self.assertEqual([d.related(WorkDays.user_id).user_id for d in days], [d.user_id for d in days])
+        self.assertEqual(len(self.statements), 4)
+        self.db.query_while_streaming = False
+        self.assertRaises(ValueError, self.db.select(WorkDays).prefetch(WorkDays.user_id).iter)
+
+    def test_e_compact_parent(self):
+        self.db.create_tables(Tags)
+        self.db.insert(Tags(name='t')).do()
+        tag = self.db.select(Tags).one()
+        tag._attach(Tags.name, 'value')
+        self.assertEqual(tag.related(Tags.name), 'value')
+
+
+class TestAggregates(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection('sqlite://:memory:')
+        self.db.create_tables(Users, UserRates, RateName)
+        self.db.insert_many([Users(login=f'user_{i}', password='x') for i in range(4)])
+        self.db.insert_many([RateName(name='day'), RateName(name='night')])
+        self.db.insert_many([UserRates(user_id=i % 3 + 1, rate_name_id=i % 2 + 1, value=i) for i in range(7)])
+        self.statements = list()
+        self.db.on('before_execute', lambda db, sql, args: self.statements.append((sql, args)))
+
+    def test_a_count_and_exists(self):
+        self.assertEqual(self.db.select(UserRates).count(), 7)
+        self.assertEqual(self.statements[-1][0], 'SELECT COUNT(*) FROM user_rates')
+        self.assertEqual(self.db.select(UserRates).where(UserRates.value > 4).order_by(UserRates.value).count(), 2)
+        self.assertEqual(self.statements[-1][0], 'SELECT COUNT(*) FROM user_rates WHERE user_rates.value > ?')
+        self.assertEqual(self.db.select(UserRates).limit(3).offset(5).count(), 2)
+        self.assertTrue(self.statements[-1][0].startswith('SELECT COUNT(*) FROM (SELECT '))
+        self.assertTrue(self.db.select(Users).where(Users.login == 'user_3').exists())
+        self.assertFalse(self.db.select(Users).where(Users.login == 'nobody').exists())
+        self.assertEqual(self.statements[-1][1], ('nobody',))
+
+    def test_b_scalar_aggregates(self):
+        rates = self.db.select(UserRates).where(UserRates.user_id == 1)
+        self.assertEqual(rates.sum(UserRates.value), 9)
+        self.assertEqual(rates.avg(UserRates.value), 3.0)
+        self.assertEqual((rates.min(UserRates.value), rates.max(UserRates.value)), (0, 6))
+        self.assertEqual(self.db.select(UserRates).aggregate(count(), UserRates.user_id.count(distinct=True),
+                                                            UserRates.value.max()), (7, 3, 6))
+        self.assertIsNone(self.db.select(UserRates).where(UserRates.value > 10).sum(UserRates.value))
+        self.assertRaises(ValueError, self.db.select(UserRates).group_by(UserRates.user_id).sum, UserRates.value)
+
+    def test_c_group_by(self):
+        query = self.db.select(UserRates) \
+            .columns(UserRates.user_id, count(), UserRates.value.sum().label('total')) \
+            .where(UserRates.value > 0).group_by(UserRates.user_id) \
+            .having(UserRates.value.sum() > 5).order_by(UserRates.user_id)
+        self.assertEqual(query.sql, 'SELECT user_rates.user_id,COUNT(*),SUM(user_rates.value) AS total '
+                                    'FROM user_rates WHERE user_rates.value > ? GROUP BY user_rates.user_id '
+                                    'HAVING SUM(user_rates.value) > ? ORDER BY user_rates.user_id ASC')
+        self.assertEqual(query.args, (0, 5))
+        self.assertEqual(query.tuples(), [(1, 2, 9), (3, 2, 7)])
+        self.assertEqual(self.db.select(UserRates).columns(UserRates.user_id).group_by(UserRates.user_id).count(), 3)
+        rows = self.db.join(RateName) \
+            .inner(UserRates, UserRates.rate_name_id == RateName.rate_name_id) \
+            .columns(RateName.name, UserRates.value.max().label('top')).group_by(RateName.name).order_by(RateName.name).dicts()
+        self.assertEqual(rows, [{'name': 'day', 'top': 6}, {'name': 'night', 'top': 5}])
+
+    def test_d_statement_cache(self):
+        def query(limit):
+            return self.db.select(UserRates).columns(UserRates.user_id, UserRates.value.sum()) \
+                .group_by(UserRates.user_id).having(UserRates.value.sum() > limit)
+        self.assertEqual(query(5).compile()[0], query(8).compile()[0])
+        self.assertEqual(len(query(8).tuples()), 1)
+        self.assertEqual(self.db.join(Users, UserRates).inner(UserRates, UserRates.user_id == Users.user_id).count(), 7)
+
+    def test_e_order_by_expressions(self):
+        query = self.db.select(UserRates).columns(UserRates.user_id, count()) \
+            .group_by(UserRates.user_id).order_by(count(), desc=True).order_by(UserRates.user_id)
+        self.assertTrue(query.sql.endswith(' ORDER BY COUNT(*) DESC,user_rates.user_id ASC'))
+        self.assertEqual(query.tuples(), [(1, 3), (2, 2), (3, 2)])
+        total = UserRates.value.sum().label('total')
+        query = self.db.select(UserRates).columns(UserRates.user_id, total) \
+            .group_by(UserRates.user_id).order_by(total, desc=True)
+        self.assertTrue(query.sql.endswith(' ORDER BY total DESC'))
+        self.assertEqual(query.tuples(), [(1, 9), (3, 7), (2, 5)])
+
+        def query(cap):
+            return self.db.select(UserRates).columns(UserRates.value).where(UserRates.value > 0) \
+                .order_by(Function('MIN', UserRates.value, cap), desc=True).order_by(UserRates.value).limit(3)
+        self.assertEqual(query(3).args, (0, 3, 3))
+        self.assertEqual(query(3).scalars(), [3, 4, 5])
+        # the second shape comes from the statement cache, its values are collected in the same order
+        self.assertEqual(query(2).args, (0, 2, 3))
+        self.assertEqual(query(2).scalars(), [2, 3, 4])
+        self.assertRaises(ValueError, self.db.select(UserRates).order_by, None)
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file